@@ -0,0 +1,118 @@
+"""
+Benchmark: audio steganography (utils.audio.encode_audio / decode_audio)
+
+Generates WAV files of 1, 10 and 60 minutes and times encode and decode of
+a short message, for both the v2 container and the legacy '###' format.
+Decode time should stay flat as the file grows; only reading the WAV is
+proportional to its length.
+
+Usage:
+    python benchmarks/bench_audio.py [--minutes 1,10,60] [--rate 8000] [--legacy-loop]
+--legacy-loop also times the original string-building decoder (slow).
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.audio import encode_audio, decode_audio
+
+MESSAGE = "Regression benchmark message"
+
+
+def legacy_decode_plaintext(audio_path):
+    """The original '###' decode loop, kept here as the baseline."""
+    song = wave.open(audio_path, mode='rb')
+    frame_bytes = bytearray(list(song.readframes(song.getnframes())))
+    song.close()
+
+    extracted_bits = ""
+    for i in range(len(frame_bytes)):
+        extracted_bits += str(frame_bytes[i] & 1)
+
+    all_bytes = bytearray()
+    for i in range(0, len(extracted_bits), 8):
+        if i + 8 > len(extracted_bits):
+            break
+        all_bytes.append(int(extracted_bits[i:i+8], 2))
+
+    extracted_text = ""
+    for b in all_bytes:
+        extracted_text += chr(b)
+        if extracted_text.endswith('###'):
+            return extracted_text[:-3]
+
+
+def write_wav(path, minutes, rate):
+    rng = np.random.default_rng(0)
+    with wave.open(path, 'wb') as fd:
+        fd.setnchannels(1)
+        fd.setsampwidth(2)
+        fd.setframerate(rate)
+        remaining = int(minutes * 60 * rate)
+        while remaining:
+            n = min(remaining, rate * 60)
+            fd.writeframes(rng.integers(-2000, 2000, size=n, dtype=np.int16).tobytes())
+            remaining -= n
+
+
+def write_legacy(src, dst, message):
+    """Embed a '###' delimited plaintext message the way pre-v2 encoders did."""
+    with wave.open(src, 'rb') as song:
+        params = song.getparams()
+        frames = np.frombuffer(song.readframes(song.getnframes()), dtype=np.uint8).copy()
+    bits = np.unpackbits(np.frombuffer((message + '###').encode(), dtype=np.uint8))
+    frames[:len(bits)] = (frames[:len(bits)] & 0xFE) | bits
+    with wave.open(dst, 'wb') as fd:
+        fd.setparams(params)
+        fd.writeframes(frames.tobytes())
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--minutes", default="1,10,60")
+    parser.add_argument("--rate", type=int, default=8000, help="sample rate (16-bit mono)")
+    parser.add_argument("--legacy-loop", action="store_true")
+    args = parser.parse_args()
+
+    header = f"{'length':>8} {'size MB':>8} {'encode (s)':>11} {'decode (s)':>11} {'legacy fmt (s)':>15}"
+    if args.legacy_loop:
+        header += f" {'old loop (s)':>13}"
+    print(header)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for minutes in (float(m) for m in args.minutes.split(",")):
+            cover = os.path.join(tmp, "cover.wav")
+            stego = os.path.join(tmp, "stego.wav")
+            legacy = os.path.join(tmp, "legacy.wav")
+            write_wav(cover, minutes, args.rate)
+            write_legacy(cover, legacy, MESSAGE)
+
+            t_enc, _ = timed(lambda: encode_audio(cover, MESSAGE, stego))
+            t_dec, text = timed(lambda: decode_audio(stego))
+            t_leg, legacy_text = timed(lambda: decode_audio(legacy))
+            assert text == MESSAGE and legacy_text == MESSAGE, (text, legacy_text)
+
+            size_mb = os.path.getsize(cover) / 1e6
+            row = f"{minutes:>6g}m {size_mb:>8.1f} {t_enc:>11.3f} {t_dec:>11.3f} {t_leg:>15.3f}"
+            if args.legacy_loop:
+                t_old, _ = timed(lambda: legacy_decode_plaintext(legacy))
+                row += f" {t_old:>13.3f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
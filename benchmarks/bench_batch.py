@@ -0,0 +1,86 @@
+"""
+Benchmark: /api/encode/batch vs one /api/encode/text-image POST per cover
+
+Encodes the same password-protected message into N covers through the Flask
+test client, once as N separate requests and once as a single batch (zip in,
+zip out), and reports wall time and key derivations performed.
+
+Usage:
+    python benchmarks/bench_batch.py [--count 40] [--megapixels 0.25] [--workers N]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_cover(megapixels, seed):
+    side = int((megapixels * 1_000_000) ** 0.5)
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, size=(side, side, 3), dtype=np.uint8), "RGB").save(
+        buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=40)
+    parser.add_argument("--megapixels", type=float, default=0.25)
+    parser.add_argument("--workers", type=int, help="BATCH_WORKERS (default: CPU count)")
+    args = parser.parse_args()
+    if args.workers:
+        os.environ["BATCH_WORKERS"] = str(args.workers)
+
+    from api import app
+    from utils import crypto
+
+    covers = [make_cover(args.megapixels, i) for i in range(args.count)]
+    client = app.test_client()
+    form = {"message": "(c) example watermark", "password": "batch-secret"}
+
+    calls = crypto.kdf_stats()["calls"]
+    start = time.perf_counter()
+    for i, cover in enumerate(covers):
+        resp = client.post("/api/encode/text-image", data={**form, "image": (io.BytesIO(cover), f"{i}.png")},
+                           content_type="multipart/form-data", headers={"Accept": "image/png"})
+        assert resp.status_code == 200
+    single = time.perf_counter() - start
+    single_kdf = crypto.kdf_stats()["calls"] - calls
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED) as zf:
+        for i, cover in enumerate(covers):
+            zf.writestr(f"{i}.png", cover)
+    client.post("/api/encode/batch", data={**form, "covers": (io.BytesIO(covers[0]), "warm.png")},
+                content_type="multipart/form-data")  # start the worker pool outside the timing
+
+    calls = crypto.kdf_stats()["calls"]
+    start = time.perf_counter()
+    resp = client.post("/api/encode/batch", query_string=form, data=archive.getvalue(),
+                       content_type="application/zip")
+    body = resp.get_data()
+    batch = time.perf_counter() - start
+    assert resp.status_code == 200, "batch rejected (the zip must stay under MAX_CONTENT_LENGTH)"
+    batch_kdf = crypto.kdf_stats()["calls"] - calls
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        produced = sum(name.endswith(".png") for name in zf.namelist())
+
+    from utils.batch import BATCH_WORKERS
+    print(f"{args.count} covers, {args.megapixels} MP, {BATCH_WORKERS} workers")
+    print(f"{'mode':>10} {'seconds':>9} {'per cover (ms)':>15} {'KDF calls':>10}")
+    print(f"{'single':>10} {single:>9.2f} {single / args.count * 1000:>15.1f} {single_kdf:>10}")
+    print(f"{'batch':>10} {batch:>9.2f} {batch / args.count * 1000:>15.1f} {batch_kdf:>10}  ({produced} encoded)")
+
+
+if __name__ == "__main__":
+    main()
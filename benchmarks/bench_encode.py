@@ -0,0 +1,97 @@
+"""
+Benchmark: text-in-image embedding (utils.stego.encode_message)
+
+Compares the original per-pixel loop with the NumPy embedding engine on
+covers of increasing size. The two write different formats (null-terminated
+plaintext vs the v2 container), so instead of comparing PNGs it checks that
+decode_message reads the message back from both.
+
+Usage:
+    python benchmarks/bench_encode.py [--sizes 1,4,12] [--fill 0.5] [--repeat 3]
+Sizes are in megapixels; --fill is the fraction of the 1-bit capacity the
+message occupies (the legacy loop stops once the message is written).
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.stego import decode_message, encode_message
+
+
+def legacy_encode_message(image_path, message, output_path):
+    """The pre-NumPy plaintext embed loop, kept here as the baseline."""
+    img = Image.open(image_path).convert("RGB")
+    pixels = img.load()
+    width, height = img.size
+
+    binary_message = ''.join(format(ord(char), '08b') for char in message)
+    binary_message += '00000000'
+
+    bit_index = 0
+    for y in range(height):
+        for x in range(width):
+            pixel = list(pixels[x, y])
+            for channel in range(3):
+                if bit_index < len(binary_message):
+                    pixel[channel] = (pixel[channel] & 0xFE) | int(binary_message[bit_index])
+                    bit_index += 1
+            pixels[x, y] = tuple(pixel)
+            if bit_index >= len(binary_message):
+                break
+        else:
+            continue
+        break
+
+    img.save(output_path)
+
+
+def make_cover(megapixels):
+    side = int((megapixels * 1_000_000) ** 0.5)
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, size=(side, side, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(data, "RGB").save(buf, format="PNG", compress_level=1)
+    return buf.getvalue(), side
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="0.25,1,4,12", help="comma separated megapixel sizes")
+    parser.add_argument("--fill", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>11} {'legacy (s)':>12} {'numpy (s)':>12} {'speedup':>9}  round trip")
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_out = os.path.join(tmp, "legacy.png")
+        new_out = os.path.join(tmp, "numpy.png")
+        for mp in (float(s) for s in args.sizes.split(",")):
+            cover, side = make_cover(mp)
+            message = "x" * int(side * side * 3 // 8 * args.fill)
+
+            t_legacy = best_of(lambda: legacy_encode_message(io.BytesIO(cover), message, legacy_out), args.repeat)
+            t_new = best_of(lambda: encode_message(io.BytesIO(cover), message, new_out), args.repeat)
+            round_trip = decode_message(legacy_out) == message == decode_message(new_out)
+            print(f"{side}x{side:<6} {t_legacy:>12.3f} {t_new:>12.3f} {t_legacy / t_new:>8.1f}x  {round_trip}")
+
+
+if __name__ == "__main__":
+    main()
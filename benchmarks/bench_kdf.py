@@ -0,0 +1,52 @@
+"""
+Benchmark: key derivation latency per KDF setting (utils.crypto)
+
+Times derive_key for each spec on this host, so a deployment can pick the
+KDF env var with known cost. Keys are derived on the shared KDF pool, the
+same path encode and decode requests take.
+
+Usage:
+    python benchmarks/bench_kdf.py [--repeat 5] [--specs pbkdf2:100000,scrypt:16384:8:1]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import crypto
+
+DEFAULT_SPECS = ",".join([
+    "pbkdf2:10000",
+    "pbkdf2:100000",
+    "pbkdf2:600000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+    "scrypt:131072:8:1",
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--specs", default=DEFAULT_SPECS, help="comma separated KDF specs")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    salt = os.urandom(crypto.SALT_SIZE)
+    print(f"{'kdf':>20} {'median (ms)':>12} {'min (ms)':>10} {'memory':>9}")
+    for spec in args.specs.split(","):
+        kdf = crypto.parse_kdf(spec)
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            crypto.derive_key("correct horse battery staple", salt, kdf=kdf)
+            times.append((time.perf_counter() - start) * 1000)
+        memory = f"{128 * kdf[1] * kdf[2] / 2**20:.0f} MB" if kdf[0] == 'scrypt' else "-"
+        print(f"{spec:>20} {statistics.median(times):>12.1f} {min(times):>10.1f} {memory:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark: single-process vs shared-memory parallel mode (utils.parallel)
+
+Runs encode_message, decode_message and analyze_image on covers of
+increasing size, once on the strip engine and once on the worker pool, and
+reports where the pool starts to win. Use that size as PARALLEL_MIN_PIXELS.
+
+Usage:
+    python benchmarks/bench_parallel.py [--sizes 1,4,16,36] [--fill 0.5] [--workers N] [--repeat 3]
+Sizes are in megapixels; --fill is the fraction of the 1-bit capacity the
+message occupies. Timings include PNG decoding and encoding, as a request sees them.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import analysis, parallel, stego
+
+
+def make_cover(megapixels, seed=0):
+    side = int((megapixels * 1_000_000) ** 0.5)
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, size=(side, side, 3), dtype=np.uint8), "RGB").save(
+        buf, format="PNG", compress_level=1)
+    return buf.getvalue(), side * side
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,4,16,36")
+    parser.add_argument("--fill", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    first_win = {}
+    print(f"{args.workers} workers, message fills {args.fill:.0%} of the 1-bit capacity")
+    print(f"{'MP':>6} {'operation':>10} {'single (s)':>11} {'parallel (s)':>13} {'speedup':>8}")
+    for size in (float(s) for s in args.sizes.split(",")):
+        cover, pixels = make_cover(size)
+        message = "".join(map(chr, rng.integers(32, 127, size=int(pixels * 3 // 8 * args.fill))))
+        encoded = stego.encode_message(cover, message)
+        operations = {
+            "encode": lambda: stego.encode_message(cover, message),
+            "decode": lambda: stego.decode_message(encoded),
+            "analyze": lambda: analysis.analyze_image(cover),
+        }
+        for name, fn in operations.items():
+            parallel.configure_parallel(workers=0)
+            single, expected = best_of(args.repeat, fn)
+            parallel.configure_parallel(workers=args.workers, min_pixels=0)
+            fn()  # start the pool outside the timing
+            pooled, result = best_of(args.repeat, fn)
+            if name in ("encode", "analyze"):
+                same = np.array_equal(np.asarray(Image.open(io.BytesIO(result))),
+                                      np.asarray(Image.open(io.BytesIO(expected))))
+            else:
+                same = result == expected
+            assert same, f"{name} output differs in parallel mode"
+            speedup = single / pooled
+            if speedup > 1 and name not in first_win:
+                first_win[name] = size
+            print(f"{size:>6g} {name:>10} {single:>11.3f} {pooled:>13.3f} {speedup:>7.2f}x")
+    parallel.configure_parallel(workers=0)
+
+    for name in ("encode", "decode", "analyze"):
+        if name in first_win:
+            print(f"{name}: parallel wins from {first_win[name]:g} MP")
+        else:
+            print(f"{name}: parallel never won at these sizes")
+
+
+if __name__ == "__main__":
+    main()
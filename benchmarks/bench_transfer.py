@@ -0,0 +1,84 @@
+"""
+Benchmark: response size and peak RSS, JSON data URL vs binary responses
+
+Runs /api/encode/text-image through the Flask test client, once per mode
+in a fresh subprocess so peak RSS is not shared between runs:
+    json    multipart upload, default JSON response with a base64 data URL
+    binary  raw image/png body, Accept: image/png, raw PNG streamed back
+
+Usage:
+    python benchmarks/bench_transfer.py [--sizes 1,4,12]
+Sizes are cover sizes in megapixels.
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_cover(megapixels):
+    import numpy as np
+    from PIL import Image
+    side = int((megapixels * 1_000_000) ** 0.5)
+    rng = np.random.default_rng(0)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, size=(side, side, 3), dtype=np.uint8), "RGB").save(
+        buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def run_one(mode, megapixels):
+    """Child process: one request in the given mode, prints a JSON result line."""
+    sys.path.insert(0, ROOT)
+    from api import app
+
+    cover = make_cover(megapixels)
+    client = app.test_client()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if mode == "json":
+        resp = client.post('/api/encode/text-image',
+                           data={'image': (io.BytesIO(cover), 'cover.png'), 'message': 'hello'},
+                           content_type='multipart/form-data')
+    else:
+        resp = client.post('/api/encode/text-image', query_string={'message': 'hello'},
+                           data=cover, content_type='image/png', headers={'Accept': 'image/png'})
+    body = resp.get_data()
+    assert resp.status_code == 200, body[:200]
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "upload": len(cover),
+        "response": len(body),
+        "rss_growth_kb": peak - baseline,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,4,12")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_one(args.child[0], float(args.child[1]))
+        return
+
+    print(f"{'MP':>5} {'mode':>7} {'upload MB':>10} {'response MB':>12} {'peak RSS +MB':>13}")
+    for mp in args.sizes.split(","):
+        for mode in ("json", "binary"):
+            out = subprocess.run([sys.executable, __file__, "--child", mode, mp],
+                                 capture_output=True, text=True, check=True)
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{mp:>5} {mode:>7} {result['upload'] / 1e6:>10.2f} {result['response'] / 1e6:>12.2f} "
+                  f"{result['rss_growth_kb'] / 1024:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Pre-forked, pre-warmed server for the steganography services (Unix only).
+
+    python serve.py [api|app] [--host 127.0.0.1] [--port 5001] [--workers N]
+                    [--max-requests N] [--max-rss-mb MB]
+
+The parent binds the socket and imports the service once (Flask, PIL,
+cryptography, NumPy), then forks the workers, which share those imports.
+Before accepting traffic each worker runs a small encode/decode round trip,
+so PIL codec plugins, the cryptography backend and the KDF pool are
+initialised before the first client arrives, and starts its background
+services (service.start_services).
+
+A worker is recycled after --max-requests requests or once its RSS passes
+--max-rss-mb; the parent forks a warm replacement. The parent logs every
+worker's time-to-ready and first-request latency.
+
+Async jobs (?async=1) live in the worker that accepted them, so use
+--workers 1 or sticky routing when clients poll for job results. A worker
+due for recycling first drains its jobs: it answers new async requests with
+503 and keeps serving until every job's result has been collected or has
+expired (JOB_RESULT_TTL), then exits. On SIGTERM it waits for running jobs.
+"""
+
+import argparse
+import importlib
+import io
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import wave
+
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', os.cpu_count() or 1))
+SERVE_MAX_REQUESTS = int(os.getenv('SERVE_MAX_REQUESTS', 1000))
+SERVE_MAX_RSS_MB = float(os.getenv('SERVE_MAX_RSS_MB', 1024))
+
+DEFAULT_PORTS = {'api': 5001, 'app': 5000}
+
+
+def log(message):
+    print(f"[serve {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+def rss_mb():
+    """Current resident set size of this process in MB."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        import resource
+        # Peak rather than current RSS, but the best available off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def warm_up():
+    """Run every codec and crypto path once: text, encoded image and audio round trips plus an LSB view."""
+    import numpy as np
+    from PIL import Image
+    from utils import analysis, audio, stego
+
+    Image.init()
+    rng = np.random.default_rng()
+    cover = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, size=(128, 128, 3), dtype=np.uint8), 'RGB').save(cover, format='PNG')
+    secret = io.BytesIO()
+    Image.new('RGB', (8, 8), 'blue').save(secret, format='PNG')
+
+    encoded = stego.encode_message(cover.getvalue(), "warm-up", password="warm-up", cipher='aesgcm')
+    stego.decode_message(encoded, "warm-up")
+    encoded = stego.encode_image_in_image(cover.getvalue(), secret.getvalue(), secret_format='jpeg')
+    stego.decode_image_from_image(encoded, io.BytesIO())
+    analysis.analyze_image(cover.getvalue())
+
+    song = io.BytesIO()
+    with wave.open(song, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(8000)
+        wav_file.writeframes(rng.integers(0, 256, size=4000, dtype=np.uint8).tobytes())
+    song.seek(0)
+    out = io.BytesIO()
+    audio.encode_audio(song, "warm-up", out)
+    out.seek(0)
+    audio.decode_audio(out)
+
+
+class _RequestTimer:
+    """WSGI middleware recording when the latest request started and how many were served."""
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self.started = None
+
+    def __call__(self, environ, start_response):
+        self.count += 1
+        self.started = time.monotonic()
+        return self.app(environ, start_response)
+
+
+def run_worker(app, sock, report, spawned, max_requests, max_rss_mb):
+    """Warm up, then serve requests from the shared socket until recycled or told to stop."""
+    from werkzeug.serving import make_server
+    from service import start_services
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C
+
+    warm_up()
+    start_services(app)
+    timer = _RequestTimer(app)
+    server = make_server(*sock.getsockname()[:2], timer, fd=sock.fileno())
+    server.timeout = 1  # wake up regularly to notice SIGTERM
+    os.write(report, f"ready {os.getpid()} {time.monotonic() - spawned:.3f}\n".encode())
+
+    reason = None
+    while not stopping:
+        jobs = app.extensions.get('jobs')
+        if reason is not None and (jobs is None or not jobs.outstanding()):
+            break
+        before = timer.count
+        server.handle_request()
+        if timer.count == before or reason is not None:
+            continue
+        if timer.count == 1:
+            os.write(report, f"first {os.getpid()} {time.monotonic() - timer.started:.3f}\n".encode())
+        if timer.count >= max_requests:
+            reason = f"served {timer.count} requests"
+        elif max_rss_mb and rss_mb() > max_rss_mb:
+            reason = f"RSS {rss_mb():.0f} MB over {max_rss_mb:g} MB"
+        jobs = app.extensions.get('jobs')
+        if reason is not None and jobs is not None and jobs.outstanding():
+            # Results live only in this process: stop taking jobs, keep serving until they are collected
+            jobs.close()
+            os.write(report, f"draining {os.getpid()} {jobs.outstanding()} async jobs\n".encode())
+    jobs = app.extensions.get('jobs')
+    if jobs is not None:
+        jobs.shutdown()
+    os.write(report, f"exit {os.getpid()} {reason or 'stopped'}\n".encode())
+
+
+def spawn(app, sock, report, max_requests, max_rss_mb):
+    spawned = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, report, spawned, max_requests, max_rss_mb)
+        except BaseException as e:
+            log(f"worker failed: {e!r}")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(service, host, port, workers, max_requests=SERVE_MAX_REQUESTS, max_rss_mb=SERVE_MAX_RSS_MB):
+    """Bind host:port, import the service's Flask app and keep `workers` warm workers serving it."""
+    started = time.monotonic()
+    app = importlib.import_module(service).app
+
+    sock = socket.create_server((host, port), backlog=128)
+    # Idle workers all wait on the socket; non-blocking accept lets the losers go back to waiting
+    sock.setblocking(False)
+    read_end, report = os.pipe()
+    log(f"{service} listening on http://{host}:{sock.getsockname()[1]} with {workers} workers")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    children = {spawn(app, sock, report, max_requests, max_rss_mb) for _ in range(workers)}
+    ready = 0
+    pending = b""
+    signalled = False
+    while not stopping or children:
+        if stopping and not signalled:
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+            signalled = True
+        try:
+            readable, _, _ = select.select([read_end], [], [], 0.5)
+        except InterruptedError:
+            readable = []
+        if readable:
+            pending += os.read(read_end, 65536)
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                kind, pid, detail = line.decode().split(" ", 2)
+                if kind == "ready":
+                    ready += 1
+                    log(f"worker {pid} ready in {float(detail) * 1000:.0f} ms")
+                    if ready == workers:
+                        log(f"all {workers} workers ready in {(time.monotonic() - started) * 1000:.0f} ms")
+                elif kind == "first":
+                    log(f"worker {pid} first request took {float(detail) * 1000:.1f} ms")
+                elif kind == "draining":
+                    log(f"worker {pid} draining {detail} before recycling")
+                else:
+                    log(f"worker {pid} exiting: {detail}")
+
+        while children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            children.discard(pid)
+            if not stopping:
+                if os.waitstatus_to_exitcode(status):
+                    log(f"worker {pid} died; replacing it")
+                    time.sleep(0.5)  # don't spin if workers fail on start
+                children.add(spawn(app, sock, report, max_requests, max_rss_mb))
+    sock.close()
+    log("stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("service", nargs="?", default="api", choices=sorted(DEFAULT_PORTS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="default: 5001 for api, 5000 for app; 0 picks a free port")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--max-requests", type=int, default=SERVE_MAX_REQUESTS,
+                        help="recycle a worker after this many requests")
+    parser.add_argument("--max-rss-mb", type=float, default=SERVE_MAX_RSS_MB,
+                        help="recycle a worker once its RSS exceeds this (0 disables)")
+    args = parser.parse_args()
+    port = DEFAULT_PORTS[args.service] if args.port is None else args.port
+    serve(args.service, args.host, port, args.workers, args.max_requests, args.max_rss_mb)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Flask application factory shared by api.py (REST service) and app.py (web UI).
+
+create_app() only builds the app: no threads or worker pools start and no
+optional dependency is imported until first use. start_services() starts the
+background services (the async job queue) explicitly.
+"""
+
+import os
+
+from flask import Flask
+from dotenv import load_dotenv
+
+from service import api
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cover uploads the web UI (app.py) accepts for /api/encode/text-image
+UI_ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp'}
+
+def create_app(config=None, ui=False):
+    """
+    Build the app. With ui=True '/' serves the web UI (app.py), otherwise a
+    JSON service banner (api.py). config entries override the defaults.
+    """
+    load_dotenv()
+    app = Flask(__name__, template_folder=os.path.join(ROOT, 'templates'),
+                static_folder=os.path.join(ROOT, 'static'))
+    app.request_class = api.SpoolingRequest
+
+    app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
+    # Requests are processed in memory; uploads and results larger than this spill to disk
+    app.config['SPOOL_THRESHOLD'] = int(os.getenv('SPOOL_THRESHOLD', 10 * 1024 * 1024))
+    # Multipart cover uploads must have one of these extensions; None accepts any
+    app.config['ALLOWED_EXTENSIONS'] = UI_ALLOWED_EXTENSIONS if ui else None
+    app.config.update(config or {})
+
+    if ui:
+        from service import ui as ui_pages
+        app.register_blueprint(ui_pages.bp)
+    else:
+        app.add_url_rule('/', 'index', api.service_index)
+    app.register_blueprint(api.bp)
+    return app
+
+def start_services(app):
+    """Start the background services; a request that needs one starts it otherwise."""
+    api.start_jobs(app)
@@ -0,0 +1,654 @@
+"""
+Steganography REST API (the /api/* routes), shared by api.py and app.py
+"""
+
+from flask import Blueprint, Request, Response, current_app, request, jsonify, send_file, g, url_for
+from flask_cors import CORS
+import base64
+import io
+import shutil
+import threading
+import time
+
+from utils.stego import (
+    encode_message,
+    decode_message,
+    calculate_capacity,
+    probe_image,
+    encode_image_in_image,
+    decode_image_from_image,
+    allowed_file,
+    SECRET_FORMATS
+)
+from utils.audio import encode_audio, decode_audio, calculate_audio_capacity, probe_audio
+from utils.streams import SpooledBuffer
+from utils.batch import encode_batch, decode_batch, iter_archive, ndjson_lines, zip_results
+from utils.jobs import JobQueue, JobQueueClosedError
+from utils import admission, crypto, lsb, metrics, payload
+from utils.admission import audio_cost, image_cost, kdf_cost
+
+bp = Blueprint('api', __name__)
+CORS(bp)  # Enable CORS for Node.js communication
+
+class SpoolingRequest(Request):
+    """Keep uploads in memory, spilling to a temp file only past SPOOL_THRESHOLD bytes"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledBuffer(current_app.config['SPOOL_THRESHOLD'])
+
+HTTP_REQUESTS = metrics.Counter('stego_http_requests_total', 'API requests by endpoint, method and status',
+                                ['endpoint', 'method', 'status'])
+HTTP_SECONDS = metrics.Histogram('stego_http_request_seconds', 'API request latency until the response starts',
+                                 ['endpoint'])
+HTTP_IN_FLIGHT = metrics.Gauge('stego_http_requests_in_flight', 'API requests being handled')
+REQUEST_SIZE = metrics.Histogram('stego_http_request_size_bytes', 'Request body sizes', ['endpoint'],
+                                 buckets=metrics.SIZE_BUCKETS)
+RESPONSE_SIZE = metrics.Histogram('stego_http_response_size_bytes', 'Response body sizes, as sent', ['endpoint'],
+                                  buckets=metrics.SIZE_BUCKETS)
+JOBS = metrics.Gauge('stego_jobs', 'Async jobs held by this process, by status', ['status'])
+
+_jobs_lock = threading.Lock()
+
+def start_jobs(app):
+    """
+    Start the app's async job queue (?async=1); results are kept for
+    JOB_RESULT_TTL seconds, then dropped. Nothing runs at import time: the
+    queue starts here, or on the first async request.
+    """
+    with _jobs_lock:
+        if 'jobs' not in app.extensions:
+            app.extensions['jobs'] = JobQueue()
+        return app.extensions['jobs']
+
+def get_jobs():
+    return start_jobs(current_app)
+
+def service_index():
+    return jsonify({"status": "running", "service": "Secure-App Stego Service"})
+
+def new_buffer():
+    """In-memory output buffer that spills to disk past SPOOL_THRESHOLD"""
+    return SpooledBuffer(current_app.config['SPOOL_THRESHOLD'])
+
+def file_to_base64(fileobj):
+    """Convert a file object's contents to base64 string"""
+    fileobj.seek(0)
+    with metrics.stage('base64'):
+        return base64.b64encode(fileobj.read()).decode('utf-8')
+
+def is_raw_body():
+    """True when the media is the raw request body (e.g. Content-Type: image/png) rather than multipart"""
+    return request.mimetype not in ('multipart/form-data', 'application/x-www-form-urlencoded')
+
+def request_params():
+    """Form fields for multipart requests, query string arguments for raw bodies"""
+    return request.args if is_raw_body() else request.form
+
+def request_file(field):
+    """Seekable stream for an uploaded file field, or for the raw body; None if missing"""
+    if not is_raw_body():
+        return request.files[field].stream if field in request.files else None
+    if 'raw_body' not in g:
+        # The WSGI input can't seek, which PIL and wave need; spool it once
+        g.raw_body = new_buffer()
+        with metrics.stage('upload'):
+            shutil.copyfileobj(request.stream, g.raw_body)
+        g.raw_size = g.raw_body.tell()
+    g.raw_body.seek(0)
+    return g.raw_body if g.raw_size else None
+
+@bp.teardown_app_request
+def close_raw_body(exc):
+    raw_body = g.pop('raw_body', None)
+    if raw_body is not None:
+        raw_body.close()
+
+# ==================== METRICS ====================
+
+def endpoint_label():
+    """The matched route pattern (e.g. /api/jobs/<job_id>), so ids don't multiply the series"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def count_bytes(body, endpoint):
+    """Pass a streamed response body through, recording its size once sent (or abandoned)"""
+    sent = 0
+    try:
+        for chunk in body:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        RESPONSE_SIZE.observe(sent, endpoint=endpoint)
+
+@bp.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    REQUEST_SIZE.observe(request.content_length or 0, endpoint=endpoint_label())
+    if request.method == 'POST' and not is_raw_body():
+        # Multipart parsing (saving the uploads) happens on first access; do it here to time it
+        with metrics.stage('upload'):
+            request.files
+
+@bp.after_request
+def record_request_metrics(response):
+    endpoint = endpoint_label()
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    HTTP_SECONDS.observe(time.perf_counter() - g.metrics_started, endpoint=endpoint)
+    if response.is_streamed:
+        response.response = count_bytes(response.response, endpoint)
+    else:
+        RESPONSE_SIZE.observe(response.content_length or 0, endpoint=endpoint)
+    return response
+
+@bp.teardown_request
+def finish_request_metrics(exc):
+    if g.pop('metrics_started', None) is not None:
+        HTTP_IN_FLIGHT.dec()
+
+def media_response(output, mimetype, json_key, download_name):
+    """
+    Stream the raw result when the client Accepts its mimetype (e.g. Accept: image/png),
+    otherwise return the JSON data URL (the default).
+    """
+    if request.accept_mimetypes.best_match(['application/json', mimetype]) == mimetype:
+        size = output.tell()
+        output.seek(0)
+        response = send_file(output, mimetype=mimetype, download_name=download_name)
+        response.content_length = size
+        return response
+    try:
+        encoded_string = file_to_base64(output)
+    finally:
+        output.close()
+    return jsonify({
+        "success": True,
+        json_key: f"data:{mimetype};base64,{encoded_string}"
+    })
+
+class InvalidOptionError(ValueError):
+    """A request option the engines would reject (checked before any work is queued)"""
+
+def error_response(e):
+    """
+    JSON error body: 400 for invalid options, 429 + Retry-After when the node is
+    over its admission budget, 413 for requests no budget can hold, 503 +
+    Retry-After when the key-derivation queue is full or the worker takes no
+    new jobs, 500 otherwise
+    """
+    if isinstance(e, InvalidOptionError):
+        return jsonify({"success": False, "error": str(e)}), 400
+    if isinstance(e, admission.OverBudgetError):
+        return jsonify({"success": False, "error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+    if isinstance(e, admission.TooCostlyError):
+        return jsonify({"success": False, "error": str(e)}), 413
+    if isinstance(e, (crypto.KDFBusyError, JobQueueClosedError)):
+        return jsonify({"success": False, "error": str(e)}), 503, {"Retry-After": "1"}
+    return jsonify({"success": False, "error": str(e)}), 500
+
+def bits_per_channel_arg(form):
+    """Read the optional bits_per_channel field: 1-4 or 'auto'"""
+    value = form.get('bits_per_channel', '1')
+    if value == 'auto':
+        return value
+    try:
+        bits = int(value)
+    except ValueError:
+        bits = 0
+    if not 1 <= bits <= lsb.MAX_BITS_PER_VALUE:
+        raise InvalidOptionError(f"Bits per channel must be between 1 and {lsb.MAX_BITS_PER_VALUE}, or 'auto'")
+    return bits
+
+def text_options_arg(form):
+    """Read the optional compression (zlib / lzma / zstd) and cipher (fernet / aesgcm) fields"""
+    compression = form.get('compression') or None
+    cipher = form.get('cipher', 'fernet')
+    if compression is not None and compression not in payload.COMPRESSIONS:
+        raise InvalidOptionError(f"Unsupported compression: {compression}")
+    if compression == 'zstd' and not payload.ZSTD_AVAILABLE:
+        raise InvalidOptionError("zstd compression needs the 'zstandard' package")
+    if cipher not in crypto.CIPHERS:
+        raise InvalidOptionError(f"Unsupported cipher: {cipher}")
+    return compression, cipher
+
+class MediaResult:
+    """An encoded file waiting to be sent, and how media_response should label it"""
+    def __init__(self, output, mimetype, json_key, download_name):
+        self.output = output
+        self.mimetype = mimetype
+        self.json_key = json_key
+        self.download_name = download_name
+
+    def close(self):
+        self.output.close()
+
+def render_result(result):
+    """Response for a handler result: media via media_response, anything else as JSON fields"""
+    if isinstance(result, MediaResult):
+        return media_response(result.output, result.mimetype, result.json_key, result.download_name)
+    return jsonify({"success": True, **result})
+
+def detach_uploads():
+    """
+    Take every uploaded stream (and the spooled raw body) away from the request,
+    so a job can keep reading them after the response is sent.
+    """
+    streams = []
+    for _, upload in request.files.items(multi=True):
+        streams.append(upload.stream)
+        upload.stream = io.BytesIO()
+    raw_body = g.pop('raw_body', None)
+    if raw_body is not None:
+        streams.append(raw_body)
+    return streams
+
+def respond(work, cost):
+    """
+    Admit a request of the given cost (utils.admission), then run work(progress)
+    and return its result, or with async=1 queue it as a job and answer 202 with
+    the job's status URL straight away. The cost is held until the work is done.
+    """
+    ticket = admission.admit(cost)
+    if request_params().get('async', '').lower() not in ('1', 'true', 'yes'):
+        with ticket:
+            result = work(None)
+        return render_result(result)
+    app = current_app._get_current_object()
+
+    def run(job):
+        # Jobs run on the job pool, outside the request; new_buffer() still needs the app config
+        with ticket, app.app_context():
+            return work(job.set_progress)
+
+    uploads = detach_uploads()
+    try:
+        job = get_jobs().submit(run, uploads)
+    except JobQueueClosedError:
+        ticket.release()
+        for stream in uploads:
+            stream.close()
+        raise
+    status_url = url_for('.job_status', job_id=job.id)
+    return jsonify({"success": True, "job_id": job.id, "status": job.status, "status_url": status_url}), \
+        202, {"Location": status_url}
+
+# ==================== ROOT & HEALTH CHECK ====================
+
+@bp.route('/api/health', methods=['GET'])
+def health_check():
+    return jsonify({
+        "status": "healthy",
+        "service": "stego-service",
+        "version": "1.0.0"
+    })
+
+@bp.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text format; counts are per process (per worker under serve.py)"""
+    if 'jobs' in current_app.extensions:
+        counts = current_app.extensions['jobs'].stats()
+        for status in ('queued', 'running', 'done', 'failed'):
+            JOBS.set(counts.get(status, 0), status=status)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ==================== TEXT → IMAGE STEGANOGRAPHY ====================
+# Media can be sent as multipart fields or as the raw request body (options then
+# go in the query string). Encode results are JSON data URLs by default, or the
+# raw file when the client sends a matching Accept header.
+
+@bp.route('/api/encode/text-image', methods=['POST'])
+def encode_text_in_image():
+    try:
+        params = request_params()
+        image = request_file('image')
+        if image is None or 'message' not in params:
+             return jsonify({"success": False, "error": "Missing image or message"}), 400
+        allowed = current_app.config['ALLOWED_EXTENSIONS']
+        if allowed is not None and not is_raw_body() and not allowed_file(request.files['image'].filename, allowed):
+            return jsonify({"success": False, "error": "Invalid file type"}), 400
+
+        message = params['message']
+        password = params.get('password')
+        compression, cipher = text_options_arg(params)
+        bits_per_channel = bits_per_channel_arg(params)
+
+        def work(progress):
+            output = new_buffer()
+            try:
+                encode_message(image, message, output, password, compression, cipher, bits_per_channel)
+            except Exception:
+                output.close()
+                raise
+            return MediaResult(output, 'image/png', 'encodedImage', 'encoded.png')
+
+        return respond(work, image_cost(image, 'encode') + kdf_cost(password, 'encode'))
+
+    except InvalidOptionError as e:
+        return error_response(e)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return error_response(e)
+
+@bp.route('/api/decode/text-image', methods=['POST'])
+def decode_text_from_image():
+    try:
+        image = request_file('image')
+        if image is None:
+            return jsonify({"success": False, "error": "Missing image"}), 400
+
+        password = request_params().get('password')
+
+        return respond(lambda progress: {"text": decode_message(image, password)},
+                       image_cost(image, 'decode') + kdf_cost(password, 'decode'))
+    except Exception as e:
+        return error_response(e)
+
+
+# ==================== IMAGE → IMAGE STEGANOGRAPHY ====================
+
+@bp.route('/api/encode/image-image', methods=['POST'])
+def encode_image_in_image_api():
+    try:
+        # Two files, so multipart only
+        if 'cover_image' not in request.files or 'secret_image' not in request.files:
+            return jsonify({"success": False, "error": "Missing images"}), 400
+
+        cover = request.files['cover_image']
+        secret = request.files['secret_image']
+        # Optional: store the secret as an encoded png/webp/jpeg instead of raw pixels
+        secret_format = request.form.get('secret_format') or None
+        if secret_format is not None and secret_format.lower() not in SECRET_FORMATS:
+            raise InvalidOptionError(f"Unsupported secret image format: {secret_format}")
+        quality = request.form.get('quality', 85, type=int)
+        bits_per_channel = bits_per_channel_arg(request.form)
+        
+        cover, secret = cover.stream, secret.stream
+
+        def work(progress):
+            output = new_buffer()
+            try:
+                encode_image_in_image(cover, secret, output, secret_format, quality, bits_per_channel)
+            except Exception:
+                output.close()
+                raise
+            return MediaResult(output, 'image/png', 'encodedImage', 'encoded.png')
+        
+        return respond(work, image_cost(cover, 'encode') + image_cost(secret, 'secret'))
+
+    except Exception as e:
+        return error_response(e)
+
+@bp.route('/api/decode/image-image', methods=['POST'])
+def decode_image_from_image_api():
+    try:
+        image = request_file('image')
+        if image is None:
+             return jsonify({"success": False, "error": "Missing image"}), 400
+        
+        def work(progress):
+            output = new_buffer()
+            try:
+                secret_format = decode_image_from_image(image, output)
+            except Exception:
+                output.close()
+                raise
+            return MediaResult(output, f'image/{secret_format}', 'secretImage', f'secret.{secret_format}')
+
+        return respond(work, image_cost(image, 'decode'))
+
+    except Exception as e:
+        return error_response(e)
+
+
+# ==================== AUDIO STEGANOGRAPHY ====================
+
+@bp.route('/api/encode/audio', methods=['POST'])
+def encode_audio_api():
+    try:
+        params = request_params()
+        audio = request_file('audio')
+        if audio is None or 'message' not in params:
+             return jsonify({"success": False, "error": "Missing audio or message"}), 400
+             
+        message = params['message']
+        password = params.get('password')
+        compression, cipher = text_options_arg(params)
+        
+        if is_raw_body():
+            if request.mimetype not in ('audio/wav', 'audio/x-wav', 'audio/wave'):
+                return jsonify({"success": False, "error": "Only WAV supported"}), 400
+        elif not request.files['audio'].filename.lower().endswith('.wav'):
+             return jsonify({"success": False, "error": "Only WAV supported"}), 400
+             
+        def work(progress):
+            output = new_buffer()
+            try:
+                encode_audio(audio, message, output, password, compression, cipher, progress=progress)
+            except Exception:
+                output.close()
+                raise
+            return MediaResult(output, 'audio/wav', 'encodedAudio', 'encoded.wav')
+        
+        return respond(work, audio_cost(audio, 'encode') + kdf_cost(password, 'encode'))
+
+    except Exception as e:
+        return error_response(e)
+
+@bp.route('/api/decode/audio', methods=['POST'])
+def decode_audio_api():
+    try:
+        audio = request_file('audio')
+        if audio is None:
+             return jsonify({"success": False, "error": "Missing audio"}), 400
+             
+        password = request_params().get('password')
+        
+        return respond(lambda progress: {"text": decode_audio(audio, password)},
+                       audio_cost(audio, 'decode') + kdf_cost(password, 'decode'))
+
+    except Exception as e:
+        return error_response(e)
+
+
+# ==================== ASYNC JOBS ====================
+# Any single-file endpoint above accepts async=1 (form field, or query string for
+# raw bodies): it answers 202 with a job id, and the work runs on the job pool.
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_jobs().get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found or expired"}), 404
+    info = job.to_dict()
+    if job.status == 'done':
+        info["result_url"] = url_for('.job_result', job_id=job.id)
+    elif job.status == 'failed':
+        job.collected = True  # the error is in the status
+    return jsonify({"success": True, **info})
+
+@bp.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    try:
+        job = get_jobs().get(job_id)
+        if job is None:
+            return jsonify({"success": False, "error": "Job not found or expired"}), 404
+        if job.status == 'failed':
+            job.collected = True
+            return jsonify({"success": False, "error": job.error}), 500
+        if job.status != 'done':
+            return jsonify({"success": False, "error": "Job not finished", **job.to_dict()}), 409
+
+        result = job.result
+        if not isinstance(result, MediaResult):
+            response = render_result(result)
+        else:
+            # The result may be fetched again until it expires; send a copy
+            with job.lock:
+                output = new_buffer()
+                result.output.seek(0)
+                shutil.copyfileobj(result.output, output)
+            response = media_response(output, result.mimetype, result.json_key, result.download_name)
+        job.collected = True
+        return response
+
+    except Exception as e:
+        return error_response(e)
+
+
+# ==================== BATCH ====================
+# Files arrive as repeated multipart fields (zips allowed) or as a raw
+# application/zip body. Encode streams back a zip, decode streams NDJSON,
+# both as workers finish.
+
+def take_batch_files(field):
+    """
+    Take the uploaded files in `field` as (filename, stream) pairs. Flask closes
+    request files when the view returns, before a streamed response is generated,
+    so the streams are detached from the request and closed by batch_items().
+    """
+    if is_raw_body():
+        if request.mimetype != 'application/zip' or request_file(field) is None:
+            return []
+        return [('upload.zip', g.pop('raw_body'))]
+    files = []
+    for upload in request.files.getlist(field):
+        files.append((upload.filename, upload.stream))
+        upload.stream = io.BytesIO()
+    return files
+
+def close_batch_files(files):
+    for _, stream in files:
+        stream.close()
+
+def batch_items(files, max_member_size):
+    """Yield (name, bytes) for every taken file, expanding zip archives, then close them"""
+    try:
+        for filename, stream in files:
+            if filename.lower().endswith('.zip'):
+                yield from iter_archive(stream, max_member_size, filename)
+            else:
+                yield filename, stream.read()
+    finally:
+        close_batch_files(files)
+
+@bp.route('/api/encode/batch', methods=['POST'])
+def encode_batch_api():
+    files = []
+    streaming = False
+    try:
+        params = request_params()
+        files = take_batch_files('covers')
+        if not files or 'message' not in params:
+            return jsonify({"success": False, "error": "Missing covers or message"}), 400
+
+        compression, cipher = text_options_arg(params)
+        try:
+            results = encode_batch(
+                batch_items(files, current_app.config['MAX_CONTENT_LENGTH']),
+                params['message'],
+                password=params.get('password'),
+                compression=compression,
+                cipher=cipher,
+                bits_per_channel=bits_per_channel_arg(params),
+                salt_policy=params.get('salt_policy', 'shared'),  # shared / per-item
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        # From here the response generator closes the files
+        streaming = True
+        return Response(zip_results(results), mimetype='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename=encoded.zip'})
+
+    except Exception as e:
+        return error_response(e)
+    finally:
+        if not streaming:
+            close_batch_files(files)
+
+
+@bp.route('/api/decode/batch', methods=['POST'])
+def decode_batch_api():
+    try:
+        files = take_batch_files('images')
+        if not files:
+            return jsonify({"success": False, "error": "Missing images"}), 400
+
+        results = decode_batch(batch_items(files, current_app.config['MAX_CONTENT_LENGTH']), request_params().get('password'))
+        return Response(ndjson_lines(results), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        return error_response(e)
+
+
+# ==================== CAPACITY CHECK ====================
+
+def is_wav(stream):
+    """Sniff the RIFF/WAVE magic, leaving the stream at the start"""
+    head = stream.read(12)
+    stream.seek(0)
+    return head[:4] == b'RIFF' and head[8:12] == b'WAVE'
+
+def media_capacity(stream):
+    """Header-only capacity of an image or WAV stream, tagged with its kind"""
+    if is_wav(stream):
+        return {"kind": "audio", **calculate_audio_capacity(stream)}
+    return {"kind": "image", **calculate_capacity(stream)}
+
+@bp.route('/api/capacity', methods=['POST'])
+def check_capacity_api():
+    try:
+        # Several files: repeated 'files' fields, one result (or error) per file
+        if not is_raw_body() and 'files' in request.files:
+            capacities = []
+            for upload in request.files.getlist('files'):
+                try:
+                    capacities.append({"file": upload.filename, **media_capacity(upload.stream)})
+                except Exception as e:
+                    capacities.append({"file": upload.filename, "error": str(e)})
+            return jsonify({
+                "success": True,
+                "capacities": capacities
+            })
+
+        media = request_file('image')
+        if media is None:
+            media = request_file('audio')
+        if media is None:
+            return jsonify({"success": False, "error": "Missing image"}), 400
+            
+        capacity = media_capacity(media)
+             
+        return jsonify({
+            "success": True,
+            "capacity": capacity
+        })
+    except Exception as e:
+        return error_response(e)
+
+
+# ==================== PAYLOAD PROBE ====================
+# Reads only the first few hundred LSBs, so it answers in milliseconds for any size
+
+@bp.route('/api/probe', methods=['POST'])
+def probe_api():
+    try:
+        media = None
+        for field in ('file', 'image', 'audio'):
+            media = request_file(field)
+            if media is not None:
+                break
+        if media is None:
+            return jsonify({"success": False, "error": "Missing file"}), 400
+
+        if is_wav(media):
+            probe = {"kind": "audio", **probe_audio(media)}
+        else:
+            probe = {"kind": "image", **probe_image(media)}
+        probe["has_payload"] = probe["format"] is not None
+
+        return jsonify({
+            "success": True,
+            "probe": probe
+        })
+    except Exception as e:
+        return error_response(e)
@@ -0,0 +1,11 @@
+"""
+Web UI pages served by app.py
+"""
+
+from flask import Blueprint, render_template
+
+bp = Blueprint('ui', __name__)
+
+@bp.route('/')
+def index():
+    return render_template('index.html')
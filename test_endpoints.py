@@ -4,12 +4,19 @@ import os
 import wave
 import base64
 import json
+import signal
+import subprocess
 import sys
+import time
+import urllib.request
+import zipfile
 
 # Add current directory to path to ensure imports work
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from api import app
+from service import create_app
+
+app = create_app()
 
 class StegoFullTest(unittest.TestCase):
     def setUp(self):
@@ -163,5 +170,364 @@ class StegoFullTest(unittest.TestCase):
         self.assertTrue(cap['max_chars'] > 0)
         self.log(f"✅ Capacity Check Passed (Max chars: {cap['max_chars']})")
 
+    # ================= ENCODED SECRET IMAGE =================
+    def test_07_image_in_image_encoded(self):
+        self.log("Testing Image in Image with PNG-encoded secret...")
+        
+        data = {
+            'cover_image': (io.BytesIO(self.image_bytes), 'cover.png'),
+            'secret_image': (io.BytesIO(self.secret_image_bytes), 'secret.png'),
+            'secret_format': 'png'
+        }
+        resp_enc = self.app.post('/api/encode/image-image', data=data, content_type='multipart/form-data')
+        self.assertEqual(resp_enc.status_code, 200)
+        encoded_bytes = base64.b64decode(resp_enc.json['encodedImage'].split(',')[1])
+        
+        data_dec = {
+            'image': (io.BytesIO(encoded_bytes), 'stego_img.png')
+        }
+        resp_dec = self.app.post('/api/decode/image-image', data=data_dec, content_type='multipart/form-data')
+        self.assertTrue(resp_dec.json['secretImage'].startswith('data:image/png;base64,'))
+        
+        # The encoded secret comes back byte for byte, without re-encoding
+        from PIL import Image
+        secret = Image.open(io.BytesIO(base64.b64decode(resp_dec.json['secretImage'].split(',')[1])))
+        self.assertEqual(secret.size, (50, 50))
+        self.log("✅ Encoded Image-Image Flow Passed")
+
+    # ================= RAW BODIES & BINARY RESPONSES =================
+    def test_08_raw_body_binary_response(self):
+        self.log("Testing raw request body with Accept: image/png...")
+        msg = "Raw and binary"
+        
+        resp_enc = self.app.post('/api/encode/text-image', query_string={'message': msg},
+                                 data=self.image_bytes, content_type='image/png',
+                                 headers={'Accept': 'image/png'})
+        self.assertEqual(resp_enc.status_code, 200)
+        self.assertEqual(resp_enc.mimetype, 'image/png')
+        self.assertTrue(resp_enc.data.startswith(b'\x89PNG'))
+        
+        resp_dec = self.app.post('/api/decode/text-image', data=resp_enc.data, content_type='image/png')
+        self.assertEqual(resp_dec.json['text'], msg)
+        self.log("✅ Raw/Binary Flow Passed")
+
+    # ================= BATCH ENCODE =================
+    def test_09_batch_encode(self):
+        self.log("Testing batch encode (zip + loose file, one bad item)...")
+        msg = "Batch watermark"
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('a.png', self.image_bytes)
+            zf.writestr('broken.png', b'not an image')
+        archive.seek(0)
+
+        resp = self.app.post('/api/encode/batch', data={
+            'covers': [(archive, 'covers.zip'), (io.BytesIO(self.image_bytes), 'b.png')],
+            'message': msg,
+            'password': 'batchpass'
+        }, content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 200)
+
+        with zipfile.ZipFile(io.BytesIO(resp.data)) as results:
+            manifest = {item['file']: item for item in json.loads(results.read('manifest.json'))}
+            self.assertEqual(sorted(n for n in results.namelist() if n.endswith('.png')), ['a.png', 'b.png'])
+            self.assertFalse(manifest['broken.png']['success'])
+            self.assertTrue(manifest['b.png']['success'])
+
+            resp_dec = self.app.post('/api/decode/text-image', data={
+                'image': (io.BytesIO(results.read('b.png')), 'b.png'),
+                'password': 'batchpass'
+            }, content_type='multipart/form-data')
+        self.assertEqual(resp_dec.json['text'], msg)
+
+        resp = self.app.post('/api/encode/batch', data={
+            'covers': [(io.BytesIO(self.image_bytes), 'b.png')], 'message': msg, 'cipher': 'bogus'
+        }, content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 400)
+        self.log("✅ Batch Encode Flow Passed")
+
+    # ================= BATCH DECODE =================
+    def test_10_batch_decode(self):
+        self.log("Testing batch decode (NDJSON, duplicate skipped)...")
+        resp_enc = self.app.post('/api/encode/text-image', data={
+            'image': (io.BytesIO(self.image_bytes), 'test.png'),
+            'message': "Found it",
+            'password': 'scan'
+        }, content_type='multipart/form-data', headers={'Accept': 'image/png'})
+        stego_png = resp_enc.data
+
+        resp = self.app.post('/api/decode/batch', data={
+            'images': [(io.BytesIO(stego_png), 'a.png'), (io.BytesIO(stego_png), 'copy.png'),
+                       (io.BytesIO(self.image_bytes), 'clean.png')],
+            'password': 'scan'
+        }, content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+
+        lines = {item['file']: item for item in map(json.loads, resp.data.decode().splitlines())}
+        self.assertEqual(lines['a.png']['text'], "Found it")
+        self.assertTrue(lines['a.png']['encrypted'])
+        self.assertEqual(lines['copy.png']['duplicate_of'], 'a.png')
+        self.assertFalse(lines['clean.png']['has_payload'])
+        self.log("✅ Batch Decode Flow Passed")
+
+    # ================= ASYNC JOBS =================
+    def test_11_async_job(self):
+        self.log("Testing async audio encode with job polling...")
+        msg = "Queued audio"
+        resp = self.app.post('/api/encode/audio', data={
+            'audio': (io.BytesIO(self.audio_bytes), 'test.wav'),
+            'message': msg,
+            'async': '1'
+        }, content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 202)
+        status_url = resp.json['status_url']
+
+        for _ in range(100):
+            status = self.app.get(status_url).json
+            if status['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.05)
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['progress'], 1.0)
+
+        result = self.app.get(status['result_url'], headers={'Accept': 'audio/wav'})
+        self.assertEqual(result.mimetype, 'audio/wav')
+        resp_dec = self.app.post('/api/decode/audio', data={
+            'audio': (io.BytesIO(result.data), 'encoded.wav')
+        }, content_type='multipart/form-data')
+        self.assertEqual(resp_dec.json['text'], msg)
+
+        self.assertEqual(self.app.get('/api/jobs/unknown').status_code, 404)
+        self.log("✅ Async Job Flow Passed")
+
+    # ================= MULTI-FILE CAPACITY =================
+    def test_12_capacity_headers_only(self):
+        self.log("Testing header-only capacity for several files...")
+        # Cut off after the PNG header: no pixel data to decode
+        truncated = self.image_bytes[:64]
+        resp = self.app.post('/api/capacity', data={
+            'files': [(io.BytesIO(truncated), 'big.png'), (io.BytesIO(self.audio_bytes), 'song.wav'),
+                      (io.BytesIO(b'nonsense'), 'bad.bin')]
+        }, content_type='multipart/form-data')
+        image_cap, audio_cap, bad = resp.json['capacities']
+        self.assertEqual((image_cap['kind'], image_cap['width'], image_cap['height']), ('image', 200, 200))
+        self.assertEqual(audio_cap['kind'], 'audio')
+        self.assertEqual(audio_cap['max_bytes'], 8000 // 8)
+        self.assertIn('error', bad)
+        self.log("✅ Multi-file Capacity Passed")
+
+    # ================= PRE-FORKED SERVER =================
+    def test_13_prefork_server(self):
+        self.log("Testing the pre-forked server...")
+        root = os.path.dirname(os.path.abspath(__file__))
+        proc = subprocess.Popen([sys.executable, os.path.join(root, 'serve.py'), 'api', '--port', '0',
+                                 '--workers', '2', '--max-requests', '2'],
+                                cwd=root, stderr=subprocess.PIPE, text=True)
+        try:
+            lines = [proc.stderr.readline()]
+            base_url = lines[0].split(' listening on ')[1].split()[0]
+            while 'all 2 workers ready' not in lines[-1]:
+                lines.append(proc.stderr.readline())
+            for _ in range(5):
+                with urllib.request.urlopen(base_url + '/api/health', timeout=10) as resp:
+                    self.assertEqual(json.load(resp)['status'], 'healthy')
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            log = ''.join(lines) + proc.communicate(timeout=30)[1]
+        self.assertEqual(proc.returncode, 0)
+        self.assertIn('first request took', log)
+        self.assertIn('exiting: served 2 requests', log)
+        self.log("✅ Pre-forked Server Passed")
+
+    # ================= IMPORT-TIME BUDGET =================
+    def test_14_import_time_budget(self):
+        self.log("Testing entry point import time...")
+        root = os.path.dirname(os.path.abspath(__file__))
+        budget_ms = float(os.getenv('IMPORT_BUDGET_MS', 1000))
+        check = "import threading, {0}; assert threading.active_count() == 1, 'threads started at import'"
+        for entry in ('api', 'app'):
+            # First run writes the bytecode cache; measure the second, as a deployed worker sees it
+            subprocess.run([sys.executable, '-c', f'import {entry}'], cwd=root, check=True)
+            proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', check.format(entry)],
+                                  cwd=root, capture_output=True, text=True)
+            self.assertEqual(proc.returncode, 0, proc.stderr[-500:])
+            # Lines read "import time: self [us] | cumulative | name", nested names indented
+            timings = {}
+            for line in proc.stderr.splitlines():
+                if line.startswith('import time:') and '|' in line:
+                    _, cumulative, name = line.split('|')
+                    if cumulative.strip().isdigit():
+                        timings[name.strip()] = int(cumulative)
+            self.assertNotIn('google.generativeai', timings, f"{entry} imports Gemini eagerly")
+            self.assertLess(timings[entry] / 1000, budget_ms, f"{entry} import exceeds IMPORT_BUDGET_MS")
+        self.log("✅ Import-time Budget Passed")
+
+    # ================= ADMISSION CONTROL =================
+    def test_15_admission_control(self):
+        self.log("Testing cost-based admission control...")
+        from utils import admission
+        form = lambda: {'image': (io.BytesIO(self.image_bytes), 'test.png'), 'message': 'busy?'}
+        cost = admission.image_cost(io.BytesIO(self.image_bytes), 'encode')
+        self.assertEqual(cost.work, 200 * 200 * 3)
+
+        # Room for exactly one such request; large ones may use half the budget, small ones all of it
+        admission.configure_admission(memory_mb=cost.memory * 2 / admission.MB, max_wait=0.05,
+                                      small_mb=cost.memory / admission.MB, small_reserve=0.5)
+        try:
+            resp = self.app.post('/api/encode/text-image', data=form(), content_type='multipart/form-data')
+            self.assertEqual(resp.status_code, 200)
+
+            with admission.admit(admission.Cost(cost.memory, 0)):
+                resp = self.app.post('/api/encode/text-image', data=form(), content_type='multipart/form-data')
+                self.assertEqual(resp.status_code, 429)
+                self.assertIn('Retry-After', resp.headers)
+                # Small requests still get in
+                with admission.admit(admission.Cost(cost.memory // 2, 0)):
+                    pass
+            self.assertEqual(admission.admission_stats()['rejected'], 1)
+
+            admission.configure_admission(memory_mb=cost.memory / 2 / admission.MB)
+            resp = self.app.post('/api/encode/text-image', data=form(), content_type='multipart/form-data')
+            self.assertEqual(resp.status_code, 413)
+
+            # Batch files are admitted one by one; one that can never fit is a manifest error
+            resp = self.app.post('/api/encode/batch', data={
+                'covers': [(io.BytesIO(self.image_bytes), 'big.png')], 'message': 'busy?'
+            }, content_type='multipart/form-data')
+            self.assertEqual(resp.status_code, 200)
+            with zipfile.ZipFile(io.BytesIO(resp.data)) as results:
+                manifest = json.loads(results.read('manifest.json'))
+            self.assertFalse(manifest[0]['success'])
+            self.assertIn('too large', manifest[0]['error'])
+        finally:
+            admission.configure_admission(admission.ADMISSION_MEMORY_MB, admission.ADMISSION_WORK_MVALUES,
+                                          admission.ADMISSION_MAX_WAIT, admission.ADMISSION_SMALL_MB,
+                                          admission.ADMISSION_SMALL_RESERVE)
+        self.log("✅ Admission Control Passed")
+
+    # ================= METRICS =================
+    def test_16_metrics(self):
+        self.log("Testing the Prometheus metrics endpoint...")
+        data = {'image': (io.BytesIO(self.image_bytes), 'test.png'), 'message': 'measured', 'password': 'pw'}
+        resp = self.app.post('/api/encode/text-image', data=data, content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.app.get('/api/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        body = resp.get_data(as_text=True)
+        self.assertRegex(body, r'stego_http_requests_total\{endpoint="/api/encode/text-image",'
+                               r'method="POST",status="200"\} [1-9]')
+        self.assertIn('stego_http_request_seconds_bucket{endpoint="/api/encode/text-image",le="+Inf"}', body)
+        for stage in ('upload', 'image_decode', 'kdf', 'encrypt', 'lsb_embed', 'image_encode', 'base64'):
+            self.assertIn(f'stego_stage_seconds_count{{stage="{stage}"}}', body)
+        self.assertRegex(body, r'stego_http_request_size_bytes_sum\{endpoint="/api/encode/text-image"\} [1-9]')
+        self.assertIn('stego_http_response_size_bytes_bucket{endpoint="/api/encode/text-image",le="1024"}', body)
+        self.assertIn('stego_http_requests_in_flight 1', body)  # the scrape itself
+        self.assertIn('# TYPE stego_key_cache_hit_ratio gauge', body)
+        self.assertIn('# TYPE stego_admission_rejected_total counter', body)
+        self.log("✅ Metrics Passed")
+
+    # ================= OPTION VALIDATION =================
+    def test_17_invalid_options(self):
+        self.log("Testing bad encode options answer 400...")
+        for field, value in (('bits_per_channel', 'x'), ('bits_per_channel', '0'),
+                             ('compression', 'bogus'), ('cipher', 'bogus')):
+            resp = self.app.post('/api/encode/text-image', data={
+                'image': (io.BytesIO(self.image_bytes), 'test.png'), 'message': 'hi', field: value
+            }, content_type='multipart/form-data')
+            self.assertEqual(resp.status_code, 400, f"{field}={value}")
+            self.assertFalse(resp.json['success'])
+        resp = self.app.post('/api/encode/audio', data={
+            'audio': (io.BytesIO(self.audio_bytes), 'test.wav'), 'message': 'hi', 'cipher': 'bogus'
+        }, content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.app.post('/api/encode/image-image', data={
+            'cover_image': (io.BytesIO(self.image_bytes), 'cover.png'),
+            'secret_image': (io.BytesIO(self.image_bytes), 'secret.png'),
+            'secret_format': 'gif'
+        }, content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 400)
+        self.log("✅ Option Validation Passed")
+
+    # ================= WEB UI UPLOADS =================
+    def test_18_ui_upload_extensions(self):
+        self.log("Testing the web UI's cover extension check...")
+        ui_client = create_app(ui=True).test_client()
+        data = lambda name: {'image': (io.BytesIO(self.image_bytes), name), 'message': 'hi'}
+        resp = ui_client.post('/api/encode/text-image', data=data('cover.gif'), content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json['error'], "Invalid file type")
+        resp = ui_client.post('/api/encode/text-image', data=data('cover.png'), content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 200)
+        # The REST service accepts any name
+        resp = self.app.post('/api/encode/text-image', data=data('cover.gif'), content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 200)
+        self.log("✅ UI Upload Extensions Passed")
+
+    # ================= CORRUPTED BATCH ARCHIVES =================
+    def test_19_batch_corrupted_member(self):
+        self.log("Testing batch zips with a corrupted member...")
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_STORED) as zf:
+            zf.writestr('a.png', self.image_bytes)
+            zf.writestr('b.png', self.image_bytes)
+        data = bytearray(archive.getvalue())
+        # Flip a byte inside b.png's stored data: its CRC no longer matches
+        offset = data.rfind(b'b.png', 0, data.find(b'PK\x01\x02')) + len('b.png') + 100
+        data[offset] ^= 0xFF
+
+        resp = self.app.post('/api/encode/batch', data={
+            'covers': [(io.BytesIO(bytes(data)), 'covers.zip')], 'message': 'intact?'
+        }, content_type='multipart/form-data')
+        self.assertEqual(resp.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(resp.data)) as results:
+            manifest = {item['file']: item for item in json.loads(results.read('manifest.json'))}
+        self.assertTrue(manifest['a.png']['success'])
+        self.assertFalse(manifest['b.png']['success'])
+        self.assertIn('Corrupted', manifest['b.png']['error'])
+
+        resp = self.app.post('/api/decode/batch', data={'images': [(io.BytesIO(bytes(data)), 'images.zip')]},
+                             content_type='multipart/form-data')
+        lines = {item['file']: item for item in map(json.loads, resp.data.decode().splitlines())}
+        self.assertEqual(sorted(lines), ['a.png', 'b.png'])
+        self.assertIn('Corrupted', lines['b.png']['error'])
+        self.log("✅ Corrupted Batch Member Passed")
+
+    # ================= RECYCLING WITH ASYNC JOBS =================
+    def test_20_recycling_drains_jobs(self):
+        self.log("Testing a recycled worker keeps its async jobs...")
+        root = os.path.dirname(os.path.abspath(__file__))
+        proc = subprocess.Popen([sys.executable, os.path.join(root, 'serve.py'), 'api', '--port', '0',
+                                 '--workers', '1', '--max-requests', '1'],
+                                cwd=root, stderr=subprocess.PIPE, text=True)
+        try:
+            lines = [proc.stderr.readline()]
+            base_url = lines[0].split(' listening on ')[1].split()[0]
+            while 'all 1 workers ready' not in lines[-1]:
+                lines.append(proc.stderr.readline())
+            # The job's request is the worker's last before recycling
+            submit = urllib.request.Request(base_url + '/api/encode/audio?async=1&message=kept',
+                                            data=self.audio_bytes, headers={'Content-Type': 'audio/wav'})
+            with urllib.request.urlopen(submit, timeout=10) as resp:
+                status_url = json.load(resp)['status_url']
+            while True:
+                with urllib.request.urlopen(base_url + status_url, timeout=10) as resp:
+                    status = json.load(resp)
+                if status['status'] == 'done':
+                    break
+                time.sleep(0.05)
+            with urllib.request.urlopen(base_url + status['result_url'], timeout=10) as resp:
+                self.assertTrue(json.load(resp)['encodedAudio'].startswith('data:audio/wav'))
+            while 'exiting' not in lines[-1]:
+                lines.append(proc.stderr.readline())
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            log = ''.join(lines) + proc.communicate(timeout=30)[1]
+        self.assertIn('draining 1 async jobs', log)
+        self.assertIn('exiting: served 1 requests', log)
+        self.log("✅ Recycling With Async Jobs Passed")
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,385 @@
+import unittest
+import io
+import os
+import sys
+import threading
+import wave
+from unittest import mock
+
+import numpy as np
+from cryptography.fernet import Fernet
+from PIL import Image, features
+
+# Add current directory to path to ensure imports work
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils import analysis, batch, container, crypto, lsb, parallel, stego, strips, audio, payload as text_payload
+
+
+def embed_raw(image_bytes, data):
+    """Write `data` into the image LSBs with no framing, the way pre-v2 encoders did."""
+    img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    channels = np.asarray(img).reshape(-1).copy()
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    channels[:len(bits)] = (channels[:len(bits)] & 0xFE) | bits
+    out = io.BytesIO()
+    Image.fromarray(channels.reshape(img.height, img.width, 3), 'RGB').save(out, format='PNG')
+    return out.getvalue()
+
+
+def embed_raw_audio(audio_bytes, data):
+    """embed_raw for a WAV: one bit in the LSB of each frame byte."""
+    with wave.open(io.BytesIO(audio_bytes), 'rb') as song:
+        params = song.getparams()
+        frames = np.frombuffer(song.readframes(song.getnframes()), dtype=np.uint8).copy()
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    frames[:len(bits)] = (frames[:len(bits)] & 0xFE) | bits
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as fd:
+        fd.setparams(params)
+        fd.writeframes(frames.tobytes())
+    return out.getvalue()
+
+
+class StegoFormatTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        img = Image.fromarray(rng.integers(0, 256, size=(120, 90, 3), dtype=np.uint8), 'RGB')
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        self.image_bytes = buf.getvalue()
+
+        audio_buf = io.BytesIO()
+        with wave.open(audio_buf, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(8000)
+            wav_file.writeframes(rng.integers(0, 256, size=16000, dtype=np.uint8).tobytes())
+        self.audio_bytes = audio_buf.getvalue()
+
+    def encode_text(self, message, password=None, compression=None, cipher='fernet'):
+        out = io.BytesIO()
+        out.name = 'out.png'
+        stego.encode_message(io.BytesIO(self.image_bytes), message, out, password, compression, cipher)
+        return out.getvalue()
+
+    def test_v2_header_written(self):
+        encoded = self.encode_text("hello")
+        img = Image.open(io.BytesIO(encoded)).convert('RGB')
+        lsbs = np.asarray(img).reshape(-1)[:container.HEADER_SIZE * 8] & 1
+        header = container.parse_header(np.packbits(lsbs).tobytes())
+        self.assertIsNotNone(header)
+        self.assertEqual(header.length, 5)
+
+    def test_compression_and_ciphers_round_trip(self):
+        message = '{"event": "login", "user": "alice"}\n' * 40
+        plain_size = len(container.pack(message.encode()))
+        for compression in (None, 'zlib', 'lzma'):
+            for cipher in ('fernet', 'aesgcm'):
+                encoded = self.encode_text(message, "pw", compression, cipher)
+                self.assertEqual(stego.decode_message(io.BytesIO(encoded), "pw"), message)
+            payload, flags = text_payload.build_text(message, compression=compression)
+            self.assertEqual(container.compression_from_flags(flags), compression)
+            if compression:
+                self.assertLess(len(payload) * 5, plain_size)
+
+    def test_k_lsb_auto_picks_smallest_fit(self):
+        capacity = stego.calculate_capacity(io.BytesIO(self.image_bytes))
+        message = "k" * (capacity['bits_per_channel'][2]['max_chars'] + 10)
+        with self.assertRaises(ValueError):
+            self.encode_text(message)
+        out = io.BytesIO()
+        out.name = 'out.png'
+        stego.encode_message(io.BytesIO(self.image_bytes), message, out, bits_per_channel='auto')
+        img = Image.open(io.BytesIO(out.getvalue())).convert('RGB')
+        lsbs = np.asarray(img).reshape(-1)[:container.HEADER_SIZE * 8] & 1
+        header = container.parse_header(np.packbits(lsbs).tobytes())
+        self.assertEqual(container.bits_from_flags(header.flags), 3)
+        self.assertEqual(stego.decode_message(io.BytesIO(out.getvalue())), message)
+
+    def test_bytes_in_bytes_out(self):
+        encoded = stego.encode_message(self.image_bytes, "in memory")
+        self.assertTrue(encoded.startswith(b"\x89PNG"))
+        self.assertEqual(stego.decode_message(encoded), "in memory")
+        wav = audio.encode_audio(self.audio_bytes, "in memory")
+        self.assertEqual(audio.decode_audio(wav), "in memory")
+
+    def test_probe_reads_only_leading_rows(self):
+        encoded = self.encode_text("probe me", password="pw", compression='zlib')
+        # Drop the second half of the file: a full decode would fail, the probe never gets there
+        probe = stego.probe_image(io.BytesIO(encoded[:len(encoded) // 2]))
+        self.assertEqual((probe['format'], probe['payload'], probe['encrypted']), ('v2', 'text', True))
+        self.assertEqual(probe['length'], len(text_payload.build_text("probe me", "pw")[0]))
+        self.assertIsNone(stego.probe_image(io.BytesIO(self.image_bytes))['format'])
+
+    def test_secret_image_on_tiny_cover(self):
+        tiny = io.BytesIO()
+        Image.new('RGB', (3, 3), 'red').save(tiny, format='PNG')
+        for secret_format in (None, 'png', 'jpeg'):
+            with self.assertRaisesRegex(ValueError, "too small to hide the secret"):
+                stego.encode_image_in_image(tiny.getvalue(), self.image_bytes, secret_format=secret_format)
+
+    def test_probe_partial_png_decode(self):
+        # Pins the Pillow behaviour stego._png_head relies on: one tile whose extents can be shrunk
+        img = Image.open(io.BytesIO(self.image_bytes))
+        self.assertEqual(len(img.tile), 1)
+        head = stego._png_head(img, 5)
+        self.assertIsNotNone(head, "Pillow no longer supports the partial PNG decode")
+        expected = Image.open(io.BytesIO(self.image_bytes)).convert('RGB').crop((0, 0, 90, 5))
+        self.assertEqual(head.tobytes(), expected.tobytes())
+
+        jpeg = io.BytesIO()
+        Image.open(io.BytesIO(self.image_bytes)).save(jpeg, format='JPEG')
+        self.assertIsNone(stego._open_head(jpeg, 10)[0])
+        self.assertIsNone(stego.probe_image(jpeg.getvalue())['format'])
+
+    @unittest.skipUnless(features.check('webp'), "Pillow built without WebP")
+    def test_probe_lossless_webp(self):
+        encoded = Image.open(io.BytesIO(self.encode_text("in a webp")))
+        webps = {}
+        for lossless in (True, False):
+            webps[lossless] = io.BytesIO()
+            encoded.save(webps[lossless], format='WEBP', lossless=lossless)
+        self.assertEqual(stego.probe_image(webps[True].getvalue())['format'], 'v2')
+        self.assertEqual(stego.decode_message(webps[True].getvalue()), "in a webp")
+        self.assertIsNone(stego.probe_image(webps[False].getvalue())['format'])
+
+    def test_legacy_plaintext_image(self):
+        legacy = embed_raw(self.image_bytes, "old message".encode() + b"\x00")
+        self.assertEqual(stego.decode_message(io.BytesIO(legacy)), "old message")
+
+    def test_vectorised_embed_matches_per_pixel_layout(self):
+        message = "same pixels " * 40
+        payload, flags = text_payload.build_text(message)
+        bits = ''.join(format(byte, '08b') for byte in container.pack(payload, flags | container.bits_flag(1)))
+        # The original encoder: R, G, B of each pixel in row-major order, one bit each
+        img = Image.open(io.BytesIO(self.image_bytes)).convert('RGB')
+        pixels = img.load()
+        bit_index = 0
+        for y in range(img.height):
+            for x in range(img.width):
+                pixel = list(pixels[x, y])
+                for channel in range(3):
+                    if bit_index < len(bits):
+                        pixel[channel] = (pixel[channel] & 0xFE) | int(bits[bit_index])
+                        bit_index += 1
+                pixels[x, y] = tuple(pixel)
+        encoded = Image.open(io.BytesIO(self.encode_text(message)))
+        self.assertEqual(np.asarray(encoded).tobytes(), np.asarray(img).tobytes())
+
+    def test_legacy_decode_stops_at_terminator(self):
+        cover = io.BytesIO()
+        Image.new('RGB', (1000, 1000)).save(cover, format='PNG')
+        legacy = embed_raw(cover.getvalue(), b"short\x00")
+        channel_reader = stego._channel_reader
+        spans = []
+
+        def counting_reader(img):
+            read = channel_reader(img)
+
+            def counted(start, end):
+                spans.append(end - start)
+                return read(start, end)
+            return counted
+
+        with mock.patch.object(stego, '_channel_reader', counting_reader):
+            self.assertEqual(stego.decode_message(io.BytesIO(legacy)), "short")
+        # The first block holds the terminator; the other 2.99M channel values are never read
+        self.assertLessEqual(sum(spans), lsb.SCAN_BLOCK_SIZE + container.HEADER_SIZE * 8)
+
+    def test_corrupted_payload_detected(self):
+        encoded = self.encode_text("hello")
+        img = Image.open(io.BytesIO(encoded)).convert('RGB')
+        channels = np.asarray(img).reshape(-1).copy()
+        channels[container.HEADER_SIZE * 8 + 3] ^= 1  # flip a payload bit
+        out = io.BytesIO()
+        Image.fromarray(channels.reshape(img.height, img.width, 3), 'RGB').save(out, format='PNG')
+        self.assertIn("corrupted", stego.decode_message(io.BytesIO(out.getvalue())))
+
+    def test_decompression_bomb_rejected(self):
+        # 1 MB of zeros compresses to about 1 KB, well within the cover
+        encoded = self.encode_text("\0" * 1_000_000, compression='zlib')
+        for method in ('zlib', 'lzma'):
+            with self.assertRaises(ValueError):
+                text_payload.decompress(text_payload.compress(b"\0" * 1_000_000, method), method, limit=65536)
+        limit = text_payload.MAX_MESSAGE_BYTES
+        text_payload.MAX_MESSAGE_BYTES = 65536
+        try:
+            self.assertTrue(stego.decode_message(encoded).startswith("❌ Hidden data is corrupted"))
+        finally:
+            text_payload.MAX_MESSAGE_BYTES = limit
+        self.assertEqual(len(stego.decode_message(encoded)), 1_000_000)
+
+    def test_legacy_plaintext_audio(self):
+        legacy = embed_raw_audio(self.audio_bytes, b"old audio###")
+        self.assertEqual(audio.decode_audio(io.BytesIO(legacy)), "old audio")
+
+    def test_legacy_encrypted_image_and_audio(self):
+        salt = b"s" * crypto.SALT_SIZE
+        data = b"ENC:" + salt + Fernet(crypto.derive_key("pw", salt)).encrypt("old secret".encode())
+        image = embed_raw(self.image_bytes, data + b"\x00")
+        wav = embed_raw_audio(self.audio_bytes, data + b"\xff" * 5)
+        self.assertEqual(stego.decode_message(io.BytesIO(image), "pw"), "old secret")
+        self.assertEqual(audio.decode_audio(io.BytesIO(wav), "pw"), "old secret")
+        self.assertEqual(stego.decode_message(io.BytesIO(image), "nope"), "❌ Incorrect password or corrupted data.")
+        self.assertEqual(audio.decode_audio(io.BytesIO(wav), "nope"), "❌ Incorrect password or corrupted data.")
+
+    def test_audio_payload_spans_chunks(self):
+        message = "streamed " * 60
+        original = audio.CHUNK_FRAMES
+        audio.CHUNK_FRAMES = 64
+        try:
+            out = io.BytesIO()
+            audio.encode_audio(io.BytesIO(self.audio_bytes), message, out, password="pw")
+            out.seek(0)
+            self.assertEqual(audio.decode_audio(out, "pw"), message)
+        finally:
+            audio.CHUNK_FRAMES = original
+        self.assertEqual(len(out.getvalue()), len(self.audio_bytes))
+
+    def test_strip_processing_matches_whole_image(self):
+        message = "banded " * 120
+        original = strips.STRIP_HEIGHT
+        strips.STRIP_HEIGHT = 7
+        try:
+            encoded = self.encode_text(message, compression='zlib')
+            self.assertEqual(stego.decode_message(io.BytesIO(encoded)), message)
+            view = analysis.analyze_image(io.BytesIO(self.image_bytes))
+        finally:
+            strips.STRIP_HEIGHT = original
+        expected = (np.asarray(Image.open(io.BytesIO(self.image_bytes)).convert('RGB')) & 1) * 255
+        self.assertTrue(np.array_equal(np.asarray(Image.open(io.BytesIO(view))), expected))
+
+    def test_parallel_mode_matches_single_process(self):
+        message = "cores " * 300
+        secret = Image.fromarray(np.full((20, 20, 3), 90, dtype=np.uint8), 'RGB')
+        secret_buf = io.BytesIO()
+        secret.save(secret_buf, format='PNG')
+        expected = [self.encode_text(message, compression='zlib'),
+                    stego.encode_image_in_image(io.BytesIO(self.image_bytes), io.BytesIO(secret_buf.getvalue()),
+                                                bits_per_channel=3)]
+        parallel.configure_parallel(workers=3, min_pixels=0)
+        try:
+            encoded = [self.encode_text(message, compression='zlib'),
+                       stego.encode_image_in_image(io.BytesIO(self.image_bytes), io.BytesIO(secret_buf.getvalue()),
+                                                   bits_per_channel=3)]
+            # The PNG is written from the shared block rather than by PIL, so compare pixels
+            for data, reference in zip(encoded, expected):
+                self.assertTrue(np.array_equal(np.asarray(Image.open(io.BytesIO(data))),
+                                               np.asarray(Image.open(io.BytesIO(reference)))))
+            out_bmp = io.BytesIO()
+            out_bmp.name = 'stego.bmp'
+            stego.encode_message(io.BytesIO(self.image_bytes), message, output_path=out_bmp, compression='zlib')
+            self.assertEqual(stego.decode_message(io.BytesIO(out_bmp.getvalue())), message)
+            self.assertEqual(stego.decode_message(io.BytesIO(encoded[0])), message)
+            out = io.BytesIO()
+            out.name = 'secret.png'
+            stego.decode_image_from_image(io.BytesIO(encoded[1]), out)
+            self.assertTrue(np.array_equal(np.asarray(Image.open(out)), np.asarray(secret)))
+            view = analysis.analyze_image(io.BytesIO(self.image_bytes))
+        finally:
+            parallel.configure_parallel(workers=parallel.PARALLEL_WORKERS, min_pixels=parallel.PARALLEL_MIN_PIXELS)
+        self.assertEqual(np.asarray(Image.open(io.BytesIO(view))).tobytes(),
+                         np.asarray(Image.open(io.BytesIO(analysis.analyze_image(io.BytesIO(self.image_bytes))))).tobytes())
+
+    def test_crashed_pool_worker_is_replaced(self):
+        # os._exit kills the worker running it, as an OOM kill would
+        results = list(batch.run_parallel(os._exit, [('crash.png', 1)]))
+        self.assertEqual([(name, result) for name, result, _ in results], [('crash.png', None)])
+        self.assertIsNotNone(results[0][2])
+        results = list(batch.encode_batch([('a.png', self.image_bytes), ('b.png', self.image_bytes)], "after"))
+        self.assertEqual([error for _, _, error in results], [None, None])
+        self.assertEqual(stego.decode_message(results[0][1]), "after")
+
+        parallel.configure_parallel(workers=2, min_pixels=0)
+        try:
+            with self.assertRaises(Exception):
+                parallel._pool.submit(os._exit, 1).result()
+            encoded = self.encode_text("after")
+            self.assertEqual(stego.decode_message(encoded), "after")
+        finally:
+            parallel.configure_parallel(workers=parallel.PARALLEL_WORKERS, min_pixels=parallel.PARALLEL_MIN_PIXELS)
+
+    def test_batch_waits_for_its_own_items(self):
+        from utils import admission
+        cost = admission.image_cost(self.image_bytes, 'encode')
+        # Each cover fits on its own, but no two at once; waiting alone never succeeds in time
+        admission.configure_admission(memory_mb=cost.memory * 1.5 / admission.MB, max_wait=0.001,
+                                      small_reserve=0)
+        try:
+            covers = [(f"{i}.png", self.image_bytes) for i in range(6)]
+            results = list(batch.encode_batch(covers, "one at a time"))
+        finally:
+            admission.configure_admission(admission.ADMISSION_MEMORY_MB, admission.ADMISSION_WORK_MVALUES,
+                                          admission.ADMISSION_MAX_WAIT, admission.ADMISSION_SMALL_MB,
+                                          admission.ADMISSION_SMALL_RESERVE)
+        self.assertEqual([error for _, _, error in results], [None] * 6)
+
+    def test_kdf_settings_recorded_in_payload(self):
+        for kdf in ('pbkdf2:2000', 'scrypt:1024:8:1'):
+            out = io.BytesIO()
+            stego.encode_message(io.BytesIO(self.image_bytes), "tuned", out, password="pw", kdf=kdf)
+            header, _ = stego._read_container(Image.open(io.BytesIO(out.getvalue())).convert('RGB'))
+            self.assertTrue(header.flags & container.FLAG_KDF)
+            self.assertEqual(stego.decode_message(io.BytesIO(out.getvalue()), "pw"), "tuned")
+
+            out = io.BytesIO()
+            audio.encode_audio(io.BytesIO(self.audio_bytes), "tuned", out, password="pw", kdf=kdf)
+            out.seek(0)
+            self.assertEqual(audio.decode_audio(out, "pw"), "tuned")
+        # The original PBKDF2 setting writes no descriptor, so older builds can still read it
+        _, flags = text_payload.build_text("plain", "pw", kdf=crypto.LEGACY_KDF)
+        self.assertFalse(flags & container.FLAG_KDF)
+        with self.assertRaises(ValueError):
+            crypto.parse_kdf('scrypt:1000:8:1')
+
+    def test_decoders_cap_payload_kdf_cost(self):
+        # Settings costlier than the limits, and than the default KDF (which always decodes)
+        encoded = [stego.encode_message(self.image_bytes, "costly", password="pw", kdf=kdf)
+                   for kdf in ('pbkdf2:%d' % (crypto.PBKDF2_ITERATIONS + 1), 'scrypt:1024:8:1')]
+        limits = crypto.KDF_MAX_DECODE_ITERATIONS, crypto.KDF_MAX_DECODE_SCRYPT_MB
+        crypto.KDF_MAX_DECODE_ITERATIONS, crypto.KDF_MAX_DECODE_SCRYPT_MB = 1000, 0.5
+        try:
+            for data in encoded:
+                self.assertIn("over this server's decode limit", stego.decode_message(data, "pw"))
+        finally:
+            crypto.KDF_MAX_DECODE_ITERATIONS, crypto.KDF_MAX_DECODE_SCRYPT_MB = limits
+        self.assertEqual([stego.decode_message(data, "pw") for data in encoded], ["costly", "costly"])
+        self.assertEqual(crypto.kdf_memory(('scrypt', 1024, 8, 1)), 128 * 1024 * 8 + 128 * 8)
+
+    def test_kdf_pool_rejects_when_full(self):
+        crypto.configure_kdf_pool(max_workers=1, max_queue=0)
+        release = threading.Event()
+        worker = threading.Thread(target=crypto._pool.run, args=(release.wait,))
+        worker.start()
+        try:
+            while crypto.kdf_stats()["in_flight"] == 0:
+                release.wait(0.001)
+            encoded = self.encode_text("queued", password=None)
+            self.assertEqual(stego.decode_message(io.BytesIO(encoded)), "queued")  # no KDF, not blocked
+            with self.assertRaises(crypto.KDFBusyError):
+                crypto.derive_key("pw", b"s" * crypto.SALT_SIZE)
+            self.assertEqual(crypto.kdf_stats()["rejected"], 1)
+        finally:
+            release.set()
+            worker.join()
+            crypto.configure_kdf_pool(crypto.KDF_MAX_WORKERS, crypto.KDF_MAX_QUEUE)
+        self.assertEqual(crypto.kdf_stats()["calls"], 0)
+
+    def test_key_cache_skips_repeat_kdf(self):
+        encoded = self.encode_text("cached", password="pw", cipher='aesgcm')
+        crypto.configure_key_cache(4, ttl=60)
+        try:
+            calls = crypto.kdf_stats()["calls"]
+            for _ in range(3):
+                self.assertEqual(stego.decode_message(io.BytesIO(encoded), "pw"), "cached")
+            self.assertIn("Incorrect", stego.decode_message(io.BytesIO(encoded), "wrong"))
+            self.assertEqual(crypto.kdf_stats()["calls"] - calls, 2)
+            stats = crypto.key_cache_stats()
+            self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (2, 2, 2))
+        finally:
+            crypto.configure_key_cache(0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
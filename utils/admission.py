@@ -0,0 +1,254 @@
+"""
+Cost-based admission control for the stego API.
+
+Before anything is decoded, a request's cost is estimated from media headers
+alone (image size and mode, WAV frame count): `memory` is the peak bytes the
+operation holds and `work` the carrier values it processes. The controller
+tracks the cost in flight against the node budget, ADMISSION_MEMORY_MB and
+ADMISSION_WORK_MVALUES (millions of channel values / sample bytes).
+
+A request that does not fit waits up to ADMISSION_MAX_WAIT seconds, smallest
+first, then fails with OverBudgetError (the API answers 429 + Retry-After).
+Requests of ADMISSION_SMALL_MB or more may only fill the budget up to
+1 - ADMISSION_SMALL_RESERVE, so the rest stays free for small requests and a
+burst of huge images cannot starve them. A request that could never fit
+fails straight away with TooCostlyError (413).
+"""
+
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+import wave
+from collections import namedtuple
+
+from PIL import Image
+
+from utils import audio, crypto, metrics, streams
+
+ADMISSION_MEMORY_MB = float(os.getenv('ADMISSION_MEMORY_MB', 2048))
+ADMISSION_WORK_MVALUES = float(os.getenv('ADMISSION_WORK_MVALUES', 1024))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 2))
+ADMISSION_SMALL_MB = float(os.getenv('ADMISSION_SMALL_MB', 64))
+ADMISSION_SMALL_RESERVE = float(os.getenv('ADMISSION_SMALL_RESERVE', 0.25))
+
+MB = 1024 * 1024
+
+
+class Cost(namedtuple('Cost', 'memory work')):
+    """Estimated peak memory (bytes) and work (carrier values) of a request."""
+    __slots__ = ()
+
+    def __add__(self, other):
+        return Cost(self.memory + other.memory, self.work + other.work)
+
+    def __sub__(self, other):
+        return Cost(self.memory - other.memory, self.work - other.work)
+
+
+FREE = Cost(0, 0)
+
+# Peak memory of each image operation, in decoded RGB rasters of the input:
+# covers also hold the output file, stego images the extracted payload, and a
+# secret image its (possibly resized) encoded copy.
+IMAGE_RASTERS = {'encode': 2.0, 'decode': 1.5, 'secret': 2.0}
+
+
+class OverBudgetError(RuntimeError):
+    """Raised when a request did not fit in the node budget within ADMISSION_MAX_WAIT."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TooCostlyError(RuntimeError):
+    """Raised for a request larger than the node budget allows any single request."""
+
+
+def image_cost(src, operation):
+    """Cost of an IMAGE_RASTERS operation on an image, from its header; src is left at the start."""
+    img = Image.open(streams.as_source(src))
+    pixels = img.width * img.height
+    raster = pixels * 3
+    memory = raster * IMAGE_RASTERS[operation]
+    if img.mode != 'RGB':
+        # The decoded source is kept alongside its RGB conversion
+        memory += pixels * len(img.getbands()) * (4 if img.mode in ('I', 'F') else 2 if ';16' in img.mode else 1)
+    if hasattr(src, 'seek'):
+        src.seek(0)
+    return Cost(int(memory), raster)
+
+
+def audio_cost(src, operation):
+    """Cost of encoding or decoding a WAV file, from its header; src is left at the start."""
+    with wave.open(streams.as_source(src), mode='rb') as song:
+        frame_size = song.getsampwidth() * song.getnchannels()
+        total = song.getnframes() * frame_size
+    if hasattr(src, 'seek'):
+        src.seek(0)
+    # Frames stream through in chunks; a decoder also holds the payload (up to 1/8 of the samples)
+    memory = 2 * audio.CHUNK_FRAMES * frame_size + (total // 8 if operation == 'decode' else 0)
+    return Cost(memory, total)
+
+
+def kdf_cost(password, operation):
+    """
+    Memory of the key derivation a request with this password runs: the KDF
+    setting's for 'encode', the most a decoder accepts for 'decode' (the
+    payload's own setting is not known before it is read).
+    """
+    if not password:
+        return FREE
+    if operation == 'encode':
+        return Cost(crypto.kdf_memory(crypto.parse_kdf(crypto.DEFAULT_KDF)), 0)
+    return Cost(crypto.max_decode_memory(), 0)
+
+
+class _Ticket:
+    """An admitted request's share of the budget, returned by release() (or on leaving a with block)."""
+
+    def __init__(self, controller, cost):
+        self._controller = controller
+        self.cost = cost
+        self._admitted = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self.cost, time.monotonic() - self._admitted)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """Tracks in-flight cost against a memory and work budget; waiters are admitted smallest first."""
+
+    def __init__(self, memory_budget, work_budget, max_wait, small_memory, small_reserve):
+        self.memory_budget = memory_budget
+        self.work_budget = work_budget
+        self.max_wait = max_wait
+        self.small_memory = small_memory
+        self.small_reserve = small_reserve
+        self._cond = threading.Condition()
+        self._in_flight = FREE
+        self._waiting = []
+        self._order = itertools.count()
+        self._hold_seconds = 1.0  # moving average of how long admitted requests run
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.too_costly = 0
+
+    def _share(self, cost):
+        """Fraction of the budget a request of this cost may fill."""
+        return 1.0 if cost.memory < self.small_memory else 1.0 - self.small_reserve
+
+    def _fits(self, cost, share):
+        total = self._in_flight + cost
+        return total.memory <= self.memory_budget * share and total.work <= self.work_budget * share
+
+    def admit(self, cost):
+        """Block until cost fits (at most max_wait seconds) and return a ticket holding it."""
+        share = self._share(cost)
+        with self._cond:
+            if cost.memory > self.memory_budget * share or cost.work > self.work_budget * share:
+                self.too_costly += 1
+                raise TooCostlyError(f"Request is too large for this server "
+                                     f"(needs ~{cost.memory / MB:.0f} MB, {cost.work / 1e6:.0f}M values)")
+            entry = (cost.memory, cost.work, next(self._order))
+            heapq.heappush(self._waiting, entry)
+            deadline = time.monotonic() + self.max_wait
+            try:
+                waited = False
+                while self._waiting[0] is not entry or not self._fits(cost, share):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise OverBudgetError("Server is busy, try again shortly",
+                                              max(1, math.ceil(self._hold_seconds)))
+                    waited = True
+                    self._cond.wait(remaining)
+                self._in_flight += cost
+                self.admitted += 1
+                self.waited += waited
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                # The next smallest waiter may fit now
+                self._cond.notify_all()
+        return _Ticket(self, cost)
+
+    def _release(self, cost, held):
+        with self._cond:
+            self._in_flight -= cost
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "memory_budget_mb": self.memory_budget / MB,
+                "work_budget_mvalues": self.work_budget / 1e6,
+                "in_flight_memory_mb": self._in_flight.memory / MB,
+                "in_flight_work_mvalues": self._in_flight.work / 1e6,
+                "waiting": len(self._waiting),
+                "admitted": self.admitted,
+                "waited": self.waited,
+                "rejected": self.rejected,
+                "too_costly": self.too_costly,
+            }
+
+
+def _new_controller(memory_mb, work_mvalues, max_wait, small_mb, small_reserve):
+    return AdmissionController(memory_mb * MB, work_mvalues * 1e6, max_wait, small_mb * MB, small_reserve)
+
+
+_controller = _new_controller(ADMISSION_MEMORY_MB, ADMISSION_WORK_MVALUES, ADMISSION_MAX_WAIT,
+                              ADMISSION_SMALL_MB, ADMISSION_SMALL_RESERVE)
+
+
+def configure_admission(memory_mb=None, work_mvalues=None, max_wait=None, small_mb=None, small_reserve=None):
+    """Replace the node's controller (e.g. from app config); requests already admitted keep their tickets."""
+    global _controller
+    old = _controller
+    _controller = _new_controller(
+        old.memory_budget / MB if memory_mb is None else memory_mb,
+        old.work_budget / 1e6 if work_mvalues is None else work_mvalues,
+        old.max_wait if max_wait is None else max_wait,
+        old.small_memory / MB if small_mb is None else small_mb,
+        old.small_reserve if small_reserve is None else small_reserve,
+    )
+
+
+def admit(cost):
+    """Admit a request of this cost on the node's controller; see AdmissionController.admit."""
+    return _controller.admit(cost)
+
+
+def admission_stats():
+    """Snapshot of the node's budget, the cost in flight and admission counters."""
+    return _controller.stats()
+
+
+@metrics.register_collector
+def _collect_metrics():
+    stats = _controller.stats()
+    return [
+        ("stego_admission_in_flight_memory_bytes", "gauge", "Estimated memory of admitted requests",
+         stats["in_flight_memory_mb"] * MB),
+        ("stego_admission_in_flight_work_values", "gauge", "Estimated carrier values of admitted requests",
+         stats["in_flight_work_mvalues"] * 1e6),
+        ("stego_admission_memory_budget_bytes", "gauge", "Memory budget for admitted requests",
+         stats["memory_budget_mb"] * MB),
+        ("stego_admission_waiting", "gauge", "Requests waiting for budget", stats["waiting"]),
+        ("stego_admission_rejected_total", "counter", "Requests refused with 429", stats["rejected"]),
+        ("stego_admission_too_costly_total", "counter", "Requests refused with 413", stats["too_costly"]),
+    ]
@@ -1,34 +1,53 @@
 from PIL import Image, ImageEnhance
+import io
+import os
 
-def analyze_image(image_path, output_path):
+from utils import parallel, streams, strips
+
+def _lsb_view(band):
+    # Extract LSBs and scale them up to be visible (0 or 255):
+    # (pixel & 0x01) * 255 is the standard LSB view.
+    return (band & 1) * 255
+
+def analyze_image(image_path, output_path=None):
     """
     Creates an LSB enhancement of the image to visualize noise.
+    With no output_path the visualization is returned as PNG bytes.
+    PNG output is written strip by strip, never as a second full-size image.
     """
-    img = Image.open(image_path)
-    img = img.convert('RGB')
-    
-    pixels = img.load()
+    img = strips.open_rgb(streams.as_source(image_path))
     width, height = img.size
-    
-    # Create the analysis image
+
+    def bands():
+        for y, band in strips.iter_strips(img):
+            yield y, _lsb_view(band)
+
+    def write_png(fp):
+        writer = strips.PNGStripWriter(fp, width, height)
+        if parallel.enabled(width * height * 3):
+            # Worker processes render and compress row ranges; they are spliced in order
+            for deflated in parallel.iter_deflated_rows(img, _lsb_view):
+                writer.write_deflated(*deflated)
+        else:
+            for _, band in bands():
+                writer.write(band)
+        writer.close()
+
+    if output_path is None:
+        buf = io.BytesIO()
+        write_png(buf)
+        return buf.getvalue()
+    if not isinstance(output_path, (str, os.PathLike)):
+        write_png(output_path)
+        return True
+    if str(output_path).lower().endswith('.png'):
+        with open(output_path, 'wb') as f:
+            write_png(f)
+        return True
+
+    # Other formats go through PIL, which needs the whole image
     analysis_img = Image.new('RGB', (width, height))
-    analysis_pixels = analysis_img.load()
-    
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            
-            # Extract LSBs and scale them up to be visible (0 or 255)
-            # We multiply by 255 so 1 becomes 255 (white) and 0 becomes 0 (black)
-            # This is a bit extreme, maybe 85 * (1 or 0) for each channel to preserve color?
-            # Let's try to just boosting the signal: 
-            # (pixel & 0x01) * 255 is the standard LSB view.
-            
-            nr = (r & 1) * 255
-            ng = (g & 1) * 255
-            nb = (b & 1) * 255
-            
-            analysis_pixels[x, y] = (nr, ng, nb)
-            
+    for y, band in bands():
+        strips.put_strip(analysis_img, y, band)
     analysis_img.save(output_path)
     return True
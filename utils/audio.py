@@ -1,147 +1,187 @@
+import io
 import wave
-import os
-import base64
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-
-def derive_key(password, salt):
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-    )
-    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
-
-def encode_audio(audio_path, message, output_path, password=None):
-    song = wave.open(audio_path, mode='rb')
-    frame_bytes = bytearray(list(song.readframes(song.getnframes())))
-
-    if password:
-        # Encryption Mode
-        salt = os.urandom(16)
-        key = derive_key(password, salt)
-        f = Fernet(key)
-        # Prefix with ENC: + SALT + encrypted_message + ###
-        encrypted_message = f.encrypt(message.encode())
-        final_payload_bytes = b"ENC:" + salt + encrypted_message
-        
-        # Convert bytes to binary string
-        binary_message = ''.join(format(byte, '08b') for byte in final_payload_bytes)
-        binary_message += '11111111' * 5 # specific terminator for encrypted binary
-    else:
-        # Plaintext Mode with delimiter
-        message += '###' 
-        binary_message = ''.join(format(ord(char), '08b') for char in message)
-    
-    if len(binary_message) > len(frame_bytes):
-        raise ValueError("Message too long for this audio file")
-
-    for i in range(len(binary_message)):
-        frame_bytes[i] = (frame_bytes[i] & 254) | int(binary_message[i])
-        
-    frame_modified = bytes(frame_bytes)
-    
-    with wave.open(output_path, 'wb') as fd:
-        fd.setparams(song.getparams())
-        fd.writeframes(frame_modified)
-    
-    song.close()
+import numpy as np
+
+from utils import container, lsb, metrics, streams, payload as text_payload
+
+# Frames held in memory at once by the streaming engine (a multiple of 8, so
+# every full chunk packs into whole payload bytes)
+CHUNK_FRAMES = 64 * 1024
+
+class _LSBReader:
+    """Sequential reader of packed frame LSBs that pulls at most CHUNK_FRAMES frames at a time."""
+
+    def __init__(self, song, chunk_frames=None):
+        self._song = song
+        self._frame_size = song.getsampwidth() * song.getnchannels()
+        self._chunk_frames = chunk_frames or CHUNK_FRAMES
+        self._packed = bytearray()
+        self._eof = False
+
+    def read(self, nbytes):
+        """Return the next `nbytes` payload bytes (fewer at the end of the file)."""
+        while len(self._packed) < nbytes and not self._eof:
+            # Read only the frames still needed, rounded up to whole bytes of LSBs
+            missing_bits = (nbytes - len(self._packed)) * 8
+            frames = -(-missing_bits // self._frame_size)
+            frames = min(-(-frames // 8) * 8, self._chunk_frames)
+            chunk = self._song.readframes(frames)
+            if len(chunk) < frames * self._frame_size:
+                self._eof = True
+            values = np.frombuffer(chunk, dtype=np.uint8)
+            values = values[:len(values) - len(values) % 8]
+            self._packed += np.packbits(values & 1).tobytes()
+        data = bytes(self._packed[:nbytes])
+        del self._packed[:nbytes]
+        return data
+
+def _decode_container(header, reader, capacity, password):
+    """Decode the payload following an already parsed v2 header."""
+    if container.bits_from_flags(header.flags) != 1:
+        raise ValueError("Unsupported payload layout (audio carries 1 bit per frame byte)")
+    if header.length > capacity - container.HEADER_SIZE:
+        raise ValueError("Hidden data is corrupted (declared length exceeds audio capacity)")
+    with metrics.stage('audio_extract'):
+        payload = reader.read(header.length)
+    container.verify(header, payload)
+    return text_payload.read_text(payload, header.flags, password)
+
+def _decode_legacy(all_bytes, reader, password):
+    """
+    Decode a pre-v2 payload: '###' terminated plaintext or ENC: + salt + token + 0xFF x5.
+    `all_bytes` holds what has already been read from `reader`.
+    """
+    all_bytes = bytearray(all_bytes)
+    if len(all_bytes) < 4:
+        return "Hidden message not found or file corrupted."
+    encrypted = all_bytes.startswith(b"ENC:")
+    delimiter = b'\xff\xff\xff\xff\xff' if encrypted else b'###'
+    search_from = 20 if encrypted else 0
+
+    # Pull LSBs in growing blocks and stop at the first delimiter; unlike v2
+    # payloads these have no length, so memory grows with the message.
+    block = lsb.SCAN_BLOCK_SIZE // 8
+    end_idx = all_bytes.find(delimiter, search_from)
+    with metrics.stage('audio_extract'):
+        while end_idx == -1:
+            more = reader.read(block)
+            if not more:
+                break
+            # A delimiter may straddle the previous block boundary
+            search_from = max(len(all_bytes) - len(delimiter) + 1, search_from)
+            all_bytes += more
+            end_idx = all_bytes.find(delimiter, search_from)
+            block = min(block * 2, CHUNK_FRAMES)
+
+    if not encrypted:
+        if end_idx == -1:
+            return "Hidden message not found or file corrupted."
+        # Old plaintext payloads were written one char per byte
+        return all_bytes[:end_idx].decode('latin-1')
+
+    if not password:
+        return "🔒 This message is encrypted. Please provide a password."
+    try:
+        # If the sentinel is missing, try the whole remainder (Fernet will reject noise)
+        return text_payload.decrypt_legacy(all_bytes[:end_idx] if end_idx != -1 else all_bytes, password)
+    except ValueError as e:
+        return str(e)
+
+def probe_audio(audio_path):
+    """
+    Report whether a WAV carries a payload, and which kind, from the LSBs of its
+    first frames only. Same fields as utils.stego.probe_image; legacy plaintext
+    is reported as format '###'.
+    """
+    with wave.open(streams.as_source(audio_path), mode='rb') as song:
+        capacity = song.getnframes() * song.getsampwidth() * song.getnchannels() // 8
+        head = _LSBReader(song).read(text_payload.PROBE_BYTES)
+
+    try:
+        header = container.parse_header(head)
+    except ValueError as e:
+        return {'format': 'v2', 'payload': None, 'encrypted': None, 'length': None, 'error': str(e)}
+    if header is not None:
+        result = container.describe(header)
+        if header.length > capacity - container.HEADER_SIZE:
+            result['error'] = "Declared length exceeds audio capacity"
+        return result
+
+    result = text_payload.sniff_legacy(head, b"###")
+    if result is None or result['format'] == 'IMG:':
+        return {'format': None, 'payload': None, 'encrypted': False, 'length': None}
+    if result['format'] == 'text':
+        result['format'] = '###'
+    return result
+
+def calculate_audio_capacity(audio_path):
+    """Capacity of a WAV file from its header fields alone (one bit per frame byte)."""
+    with wave.open(streams.as_source(audio_path), mode='rb') as song:
+        params = song.getparams()
+    max_bits = params.nframes * params.sampwidth * params.nchannels
+    return {
+        'frames': params.nframes,
+        'channels': params.nchannels,
+        'sample_width': params.sampwidth,
+        'frame_rate': params.framerate,
+        'duration_seconds': params.nframes / params.framerate if params.framerate else 0,
+        'max_bits': max_bits,
+        'max_bytes': max_bits // 8,
+        'max_chars': max(max_bits // 8 - container.HEADER_SIZE, 0),  # After the payload header
+    }
+
+def encode_audio(audio_path, message, output_path=None, password=None, compression=None, cipher='fernet',
+                 kdf=None, progress=None):
+    """
+    Hide a text message in a WAV file, one bit per frame byte.
+    compression, cipher and kdf behave as in utils.stego.encode_message.
+    Sources may be paths, bytes or file objects; with no output_path the
+    stego WAV is returned as bytes. progress, if given, is called with the
+    fraction of frames written after each chunk.
+    """
+    payload, flags = text_payload.build_text(message, password, compression, cipher, kdf)
+    bits = lsb.to_bits(container.pack(payload, flags))
+
+    target = output_path if output_path is not None else io.BytesIO()
+    with wave.open(streams.as_source(audio_path), mode='rb') as song:
+        params = song.getparams()
+        if len(bits) > params.nframes * params.sampwidth * params.nchannels:
+            raise ValueError("Message too long for this audio file")
+
+        # Stream the file through in CHUNK_FRAMES chunks. One bit per frame byte:
+        # only the leading chunks carry the payload, the rest are copied as-is.
+        with wave.open(target, 'wb') as fd, metrics.stage('audio_embed'):
+            fd.setparams(params)
+            written = 0
+            while True:
+                chunk = song.readframes(CHUNK_FRAMES)
+                if not chunk:
+                    break
+                if written < len(bits):
+                    n = min(len(bits) - written, len(chunk))
+                    head = np.frombuffer(chunk, dtype=np.uint8, count=n).copy()
+                    lsb.embed_bits(head, bits[written:written + n])
+                    fd.writeframesraw(head)
+                    fd.writeframesraw(memoryview(chunk)[n:])
+                    written += n
+                else:
+                    fd.writeframesraw(chunk)
+                if progress is not None:
+                    progress(song.tell() / max(params.nframes, 1))
+
+    if output_path is None:
+        return target.getvalue()
 
 def decode_audio(audio_path, password=None):
-    song = wave.open(audio_path, mode='rb')
-    frame_bytes = bytearray(list(song.readframes(song.getnframes())))
-    
-    # Extract bits
-    extracted_bits = ""
-    # Optimization: processing all bytes might be slow for large audio, 
-    # but we don't know the length. 
-    # For MVP we can read a chunk or just go for it.
-    # To avoid memory issues with huge strings, we should process in chunks, 
-    # but let's stick to the current logic for consistency with existing code unless it's huge.
-    
-    for i in range(len(frame_bytes)):
-        extracted_bits += str(frame_bytes[i] & 1)
-
-    # Convert to bytes
-    all_bytes = bytearray()
-    for i in range(0, len(extracted_bits), 8):
-        byte_str = extracted_bits[i:i+8]
-        if i + 8 > len(extracted_bits):
-            break 
-        val = int(byte_str, 2)
-        all_bytes.append(val)
-        
-        # Optimization: Check for termination or headers early to break?
-        # For plaintext ### (3 chars = 24 bits)
-        # For encrypted, we have a binary terminator? Or we rely on the implementation.
-        # Let's parse fully for now as per original design.
-
-    # Check for Encryption Header b"ENC:"
-    if all_bytes.startswith(b"ENC:"):
-        if not password:
-             return "🔒 This message is encrypted. Please provide a password."
-        
-        try:
-             # ENC: (4) + SALT (16) + ...
-             salt = bytes(all_bytes[4:20])
-             # We need to find where it ends.
-             # In encode, we didn't add a delimiter for the encrypted bytes themselves directly inside the encrypted payload,
-             # but we added a binary terminator 11111111...
-             # Actually, Fernet decrypt handles padding, but we need to pass the exact ciphertext bytes.
-             # The extracted `all_bytes` contains EVERYTHING till the end of audio file (noise).
-             # We need a robust terminator.
-             
-             # Re-visiting encode: I added '11111111' * 5.
-             # Let's search for that pattern? 
-             # Or better, just try decrypting the valid chunk if we can determine length.
-             # Since we don't have length header, we might have issues with trailing noise.
-             
-             # IMPROVED STRATEGY for Audio Encryption:
-             # Store length header? Or stick to the terminator.
-             
-             # Let's search for the terminator in the all_bytes if possible?
-             pass 
-        except:
-             pass
-
-    # Re-implementing decode with a more stream-lined approach to catch delimiters
-    
-    # Text mode check (###)
-    extracted_text = ""
-    for b in all_bytes:
-        extracted_text += chr(b)
-        if extracted_text.endswith('###'):
-            return extracted_text[:-3]
-
-    # Encrypted mode check
-    if all_bytes.startswith(b"ENC:"):
-        if not password:
-             return "🔒 This message is encrypted. Please provide a password."
-        
+    with wave.open(streams.as_source(audio_path), mode='rb') as song:
+        capacity = song.getnframes() * song.getsampwidth() * song.getnchannels() // 8
+        reader = _LSBReader(song)
+        head = reader.read(container.HEADER_SIZE)
         try:
-            salt = bytes(all_bytes[4:20])
-            # The rest is ciphertext + noise. Fernet needs exact ciphertext.
-            # We explicitly added 5 bytes of 0xFF (255) as terminator
-            ciphertext_with_noise = all_bytes[20:]
-            
-            # Find terminator b'\xff\xff\xff\xff\xff'
-            terminator = b'\xff\xff\xff\xff\xff'
-            end_idx = ciphertext_with_noise.find(terminator)
-            
-            if end_idx != -1:
-                ciphertext = bytes(ciphertext_with_noise[:end_idx])
-            else:
-                # If sentinel not found, maybe try decrypting everything (might fail) or just up to a reasonable point?
-                # or just take it all
-                ciphertext = bytes(ciphertext_with_noise)
-            
-            key = derive_key(password, salt)
-            f = Fernet(key)
-            decrypted_message = f.decrypt(ciphertext)
-            return decrypted_message.decode()
-        except Exception as e:
-            return f"❌ Incorrect password or corrupted data. ({str(e)})"
-
-    return "Hidden message not found or file corrupted."
+            header = container.parse_header(head)
+            if header is None:
+                # Backward compatibility: '###' (plaintext) or 0xFF x5 (encrypted) delimited payloads
+                return _decode_legacy(head, reader, password)
+            return _decode_container(header, reader, capacity, password)
+        except ValueError as e:
+            return f"❌ {e}."
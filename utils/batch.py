@@ -0,0 +1,247 @@
+"""
+Batch encoding and decoding across worker processes.
+
+A batch hides one message in many covers. With salt_policy='shared' the
+payload is built once in the parent: one salt, one key derivation and one
+encryption for the whole batch. With 'per-item' every cover gets a fresh
+salt and key, derived inside the workers. Embedding and PNG encoding, the
+CPU-heavy part, run on a shared pool of BATCH_WORKERS processes; if a worker
+dies, the items it had in flight fail and the pool is rebuilt for the rest.
+Each item is admitted against the node's admission budget (utils.admission)
+before it is submitted, and holds its cost until its worker is done with it.
+
+Encode results come back as a zip written on the fly, with manifest.json at
+the end listing each input and either its output name or its error. Decode
+results are NDJSON lines, one per input as soon as it is done; files whose
+SHA-256 was already seen in the batch are reported as duplicates, not decoded.
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import zipfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from utils import admission, crypto, lsb, pools, stego, payload as text_payload
+
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', os.cpu_count() or 1))
+SALT_POLICIES = ('shared', 'per-item')
+
+_pool = pools.ProcessPool(BATCH_WORKERS)
+
+
+def iter_archive(fileobj, max_member_size, name='archive.zip'):
+    """
+    Yield (name, bytes) for each file in a zip archive. Members larger than
+    max_member_size (uncompressed) or that fail to extract, or the archive
+    itself if it is not a valid zip, are yielded with a ValueError instead of data.
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        yield name, ValueError("Not a valid zip archive")
+        return
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                continue
+            if info.file_size > max_member_size:
+                yield info.filename, ValueError("File too large")
+                continue
+            try:
+                data = archive.read(info)
+            except (zipfile.BadZipFile, zlib.error, EOFError, OSError) as e:
+                yield info.filename, ValueError(f"Corrupted archive member: {e}")
+                continue
+            yield info.filename, data
+
+
+def run_parallel(fn, items, *args, cost=None):
+    """
+    Call fn(data, *args) for each (name, data) item on the worker pool, keeping
+    at most two tasks per worker in flight. Yields (name, result, error) in
+    completion order; items whose data is an exception are reported as errors.
+    With cost(data) -> admission.Cost, each item is admitted before it is
+    submitted (waiting for budget like any request) and released when done.
+    While the batch's own items hold budget, an item that doesn't fit waits for
+    one of them to finish rather than failing; only items the budget can't
+    hold are reported as errors.
+    """
+    pending = {}
+
+    def finish(futures):
+        for future in futures:
+            name, ticket = pending.pop(future)
+            if ticket is not None:
+                # Done callbacks run after wait() returns; don't let a retry race the release
+                ticket.release()
+            try:
+                yield name, future.result(), None
+            except Exception as e:
+                yield name, None, str(e)
+
+    def wait_for_one():
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        return finish(done)
+
+    for name, data in items:
+        if isinstance(data, Exception):
+            yield name, None, str(data)
+            continue
+        while len(pending) >= 2 * BATCH_WORKERS:
+            yield from wait_for_one()
+        ticket = None
+        try:
+            if cost is not None:
+                item_cost = cost(data)
+                while ticket is None:
+                    try:
+                        ticket = admission.admit(item_cost)
+                    except admission.OverBudgetError:
+                        if not pending:
+                            raise
+                        # The batch's own items hold the budget; one finishing frees some
+                        yield from wait_for_one()
+            future = _pool.submit(fn, data, *args)
+        except Exception as e:
+            if ticket is not None:
+                ticket.release()
+            yield name, None, str(e)
+            continue
+        if ticket is not None:
+            # Released by the pool as soon as the worker finishes, not when the caller gets to it
+            future.add_done_callback(lambda f, ticket=ticket: ticket.release())
+        pending[future] = name, ticket
+    while pending:
+        yield from wait_for_one()
+
+
+def _encode_one(cover, message, payload, flags, text_options, bits_per_channel):
+    if payload is None:
+        payload, flags = text_payload.build_text(message, **text_options)
+    return stego.embed_text_payload(cover, payload, flags, None, bits_per_channel)
+
+
+def encode_batch(items, message, password=None, compression=None, cipher='fernet', bits_per_channel=1,
+                 kdf=None, salt_policy='shared'):
+    """
+    Hide one message in every (name, cover bytes) item.
+    Options are checked (and a shared payload built) before returning, so bad
+    input raises ValueError up front; the returned generator yields
+    (name, png bytes, error) per cover as workers finish.
+    """
+    if salt_policy not in SALT_POLICIES:
+        raise ValueError(f"Unsupported salt policy: {salt_policy}")
+    if bits_per_channel != 'auto' and not 1 <= int(bits_per_channel) <= lsb.MAX_BITS_PER_VALUE:
+        raise ValueError(f"Bits per channel must be between 1 and {lsb.MAX_BITS_PER_VALUE}, or 'auto'")
+    text_options = dict(password=password, compression=compression, cipher=cipher, kdf=kdf)
+
+    payload = flags = None
+    if salt_policy == 'shared' or not password:
+        # The shared key is derived here, in the caller's thread
+        with admission.admit(admission.kdf_cost(password, 'encode')):
+            payload, flags = text_payload.build_text(message, **text_options)
+    else:
+        if cipher not in crypto.CIPHERS:
+            raise ValueError(f"Unsupported cipher: {cipher}")
+        if compression and compression not in text_payload.COMPRESSIONS:
+            raise ValueError(f"Unsupported compression: {compression}")
+        crypto.parse_kdf(kdf or crypto.DEFAULT_KDF)
+
+    # Per-item payloads derive their key in the worker
+    kdf = admission.kdf_cost(password, 'encode') if payload is None else admission.FREE
+    return run_parallel(_encode_one, items, message, payload, flags, text_options, bits_per_channel,
+                        cost=lambda cover: admission.image_cost(cover, 'encode') + kdf)
+
+
+class _ChunkSink:
+    """Write-only file object collecting what zipfile writes, drained between members."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_results(results):
+    """
+    Stream (name, png bytes, error) results as zip chunks: one <stem>.png per
+    success, then manifest.json with an entry for every input.
+    """
+    sink = _ChunkSink()
+    manifest = []
+    used = set()
+    # PNGs are already compressed; storing them keeps the zip cheap to stream
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, data, error in results:
+            if error is not None:
+                manifest.append({"file": name, "success": False, "error": error})
+                continue
+            stem = posixpath.splitext(posixpath.basename(name.replace('\\', '/')))[0] or 'image'
+            output, n = f"{stem}.png", 1
+            while output in used:
+                output, n = f"{stem}_{n}.png", n + 1
+            used.add(output)
+            archive.writestr(output, data)
+            manifest.append({"file": name, "success": True, "output": output})
+            yield sink.drain()
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    yield sink.drain()
+
+
+def _decode_one(image, password):
+    return stego.inspect_message(image, password)
+
+
+def decode_batch(items, password=None):
+    """
+    Inspect every (name, image bytes) item for a hidden text message. Yields one
+    dict per item in completion order: file, sha256 and either the
+    stego.inspect_message fields, an error, or duplicate_of naming the first
+    file with the same content.
+    """
+    seen = {}
+    duplicates = []
+    kdf = admission.kdf_cost(password, 'decode')
+
+    def unique():
+        for name, data in items:
+            if isinstance(data, Exception):
+                yield (name, None), data
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            if digest in seen:
+                duplicates.append({"file": name, "sha256": digest, "duplicate_of": seen[digest]})
+                continue
+            seen[digest] = name
+            yield (name, digest), data
+
+    for (name, digest), result, error in run_parallel(_decode_one, unique(), password,
+                                                      cost=lambda image: admission.image_cost(image, 'decode') + kdf):
+        yield from duplicates
+        duplicates.clear()
+        line = {"file": name, "sha256": digest}
+        if error is not None:
+            line.update(has_payload=False, error=error)
+        else:
+            line.update(result)
+        yield line
+    yield from duplicates
+
+
+def ndjson_lines(results):
+    """Encode result dicts as newline-delimited JSON."""
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
@@ -0,0 +1,98 @@
+"""
+Versioned payload container shared by image, image-in-image and audio stego.
+
+Every payload is embedded behind a fixed 14-byte header (big-endian):
+
+    magic    4 bytes   b"\\x89STG"
+    version  1 byte    2
+    flags    1 byte    FLAG_* bits describing the payload
+    length   4 bytes   payload length in bytes
+    crc32    4 bytes   CRC-32 of the payload
+
+The header is always embedded at 1 bit per carrier value; the payload that
+follows uses the bits-per-value recorded in the flags. Decoders read the
+header, then exactly `length` bytes, and stop. Media that
+does not start with the magic is handed to the legacy (delimiter based)
+decoders.
+"""
+
+import struct
+import zlib
+from collections import namedtuple
+
+MAGIC = b"\x89STG"
+VERSION = 2
+
+FLAG_ENCRYPTED = 0x01     # payload is encrypted (salt + ciphertext, see utils.crypto)
+FLAG_IMAGE = 0x02         # payload is an IMG:/IMZ: tagged image, not text
+COMPRESSION_MASK = 0x0C   # 2-bit codec id applied before encryption
+BITS_MASK = 0x30          # payload bits per carrier value, minus one (the header is always 1 bit)
+FLAG_AEAD = 0x40          # encrypted with raw AES-256-GCM instead of Fernet
+FLAG_KDF = 0x80           # encrypted payload starts with a KDF descriptor (see utils.crypto)
+
+_COMPRESSION_IDS = {'zlib': 1, 'lzma': 2, 'zstd': 3}
+_COMPRESSION_NAMES = {v: k for k, v in _COMPRESSION_IDS.items()}
+
+_HEADER = struct.Struct(">4sBBII")
+HEADER_SIZE = _HEADER.size
+
+Header = namedtuple("Header", ["version", "flags", "length", "crc"])
+
+
+def pack(payload, flags=0):
+    """Return header + payload, ready to be embedded."""
+    return _HEADER.pack(MAGIC, VERSION, flags, len(payload), zlib.crc32(payload)) + payload
+
+
+def parse_header(data):
+    """
+    Parse a container header from the first HEADER_SIZE bytes of `data`.
+    Returns None when the magic is absent (legacy or no payload).
+    """
+    if len(data) < HEADER_SIZE or not data.startswith(MAGIC):
+        return None
+    _, version, flags, length, crc = _HEADER.unpack(data[:HEADER_SIZE])
+    if version != VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+    return Header(version, flags, length, crc)
+
+
+def compression_flag(method):
+    """Flag bits recording a compression method."""
+    return _COMPRESSION_IDS[method] << 2
+
+
+def compression_from_flags(flags):
+    """Compression method recorded in flags, or None."""
+    return _COMPRESSION_NAMES.get((flags & COMPRESSION_MASK) >> 2)
+
+
+def bits_flag(k):
+    """Flag bits recording k payload bits per carrier value (1..4)."""
+    if not 1 <= k <= 4:
+        raise ValueError("Bits per channel must be between 1 and 4")
+    return (k - 1) << 4
+
+
+def bits_from_flags(flags):
+    """Payload bits per carrier value recorded in flags."""
+    return ((flags & BITS_MASK) >> 4) + 1
+
+
+def verify(header, payload):
+    """Raise ValueError if the payload does not match the header's length and CRC."""
+    if len(payload) != header.length or zlib.crc32(payload) != header.crc:
+        raise ValueError("Hidden data is corrupted (checksum mismatch)")
+
+
+def describe(header):
+    """Summary of a parsed header for probes: what the payload is, without reading it."""
+    return {
+        'format': 'v2',
+        'payload': 'image' if header.flags & FLAG_IMAGE else 'text',
+        'encrypted': bool(header.flags & FLAG_ENCRYPTED),
+        'cipher': ('aesgcm' if header.flags & FLAG_AEAD else 'fernet') if header.flags & FLAG_ENCRYPTED else None,
+        'compression': compression_from_flags(header.flags),
+        'bits_per_channel': bits_from_flags(header.flags),
+        'length': header.length,
+    }
@@ -0,0 +1,389 @@
+"""
+Password-based encryption shared by the image and audio engines.
+
+Two ciphers are available for payloads:
+    fernet  salt + Fernet token (AES-128-CBC + HMAC, base64 encoded)
+    aesgcm  salt + nonce + raw AES-256-GCM ciphertext, ~25% smaller than Fernet
+
+Key derivation (PBKDF2, ~50-100 ms of CPU) runs on a small shared thread pool
+rather than on whichever request thread asked for it. At most KDF_MAX_WORKERS
+derivations run at once and at most KDF_MAX_QUEUE more may wait; past that
+derive_key raises KDFBusyError straight away instead of piling up work.
+hashlib releases the GIL while hashing, so the pool threads run in parallel.
+
+The KDF is pluggable: PBKDF2-SHA256 with any iteration count, or scrypt with
+its N/r/p. KDF specs are strings such as 'pbkdf2:100000' or 'scrypt:16384:8:1';
+the KDF env var picks the deployment default. Anything other than the original
+PBKDF2 at 100,000 iterations is recorded in front of the salt,
+
+    pbkdf2  0x01 + iterations (4 bytes, big-endian)
+    scrypt  0x02 + log2(N) + r + p (1 byte each)
+
+and the container's FLAG_KDF bit tells decoders to read it back. Because
+those settings come from the (untrusted) payload, decoders only accept up to
+KDF_MAX_DECODE_ITERATIONS PBKDF2 iterations or KDF_MAX_DECODE_SCRYPT_MB of
+scrypt memory, or the KDF setting itself if that is costlier.
+
+Decoders can also opt into a small LRU cache of derived keys (KDF_CACHE_SIZE
+entries, each kept KDF_CACHE_TTL seconds), so retrying the same file with the
+same password skips the KDF. Entries are looked up by an HMAC of
+(password, salt) under a per-process random key; passwords are never stored.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from utils import metrics
+
+SALT_SIZE = 16
+NONCE_SIZE = 12
+CIPHERS = ('fernet', 'aesgcm')
+
+# ===== KDF settings =====
+PBKDF2_ITERATIONS = 100000
+LEGACY_KDF = ('pbkdf2', PBKDF2_ITERATIONS)   # implied when a payload carries no KDF descriptor
+KDFS = ('pbkdf2', 'scrypt')
+DEFAULT_KDF = os.getenv('KDF', 'pbkdf2:%d' % PBKDF2_ITERATIONS)
+
+_KDF_IDS = {'pbkdf2': 1, 'scrypt': 2}
+_KDF_NAMES = {v: k for k, v in _KDF_IDS.items()}
+# Hard limits for any KDF spec
+MAX_PBKDF2_ITERATIONS = 10_000_000
+MAX_SCRYPT_MEMORY = 256 * 1024 * 1024
+# Decoders refuse anything costlier, so a crafted payload can't pin a KDF worker or exhaust memory
+KDF_MAX_DECODE_ITERATIONS = int(os.getenv('KDF_MAX_DECODE_ITERATIONS', 600_000))
+KDF_MAX_DECODE_SCRYPT_MB = float(os.getenv('KDF_MAX_DECODE_SCRYPT_MB', 32))
+
+# ===== KDF pool =====
+KDF_MAX_WORKERS = int(os.getenv('KDF_MAX_WORKERS', min(4, os.cpu_count() or 1)))
+KDF_MAX_QUEUE = int(os.getenv('KDF_MAX_QUEUE', 32))
+
+
+class KDFBusyError(RuntimeError):
+    """Raised when the key-derivation queue is full."""
+
+
+class KDFLimitError(ValueError):
+    """Raised when a payload's KDF settings are costlier than the decode limits allow."""
+
+
+class _KDFPool:
+    """Thread pool with a hard cap on running + waiting derivations, plus timing counters."""
+
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kdf')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.calls = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise KDFBusyError("Too many password operations in progress, try again shortly")
+        with self._lock:
+            self._pending += 1
+        submitted = time.perf_counter()
+        try:
+            started, result = self._executor.submit(self._timed, fn, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+        finished = time.perf_counter()
+        with self._lock:
+            self.calls += 1
+            self.wait_seconds += started - submitted
+            self.run_seconds += finished - started
+            self.max_wait_seconds = max(self.max_wait_seconds, started - submitted)
+            self.max_run_seconds = max(self.max_run_seconds, finished - started)
+        metrics.STAGE_SECONDS.observe(started - submitted, stage='kdf_wait')
+        metrics.STAGE_SECONDS.observe(finished - started, stage='kdf')
+        return result
+
+    @staticmethod
+    def _timed(fn, *args):
+        return time.perf_counter(), fn(*args)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._pending,
+                "calls": self.calls,
+                "rejected": self.rejected,
+                "wait_seconds": self.wait_seconds,
+                "run_seconds": self.run_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "max_run_seconds": self.max_run_seconds,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_pool = _KDFPool(KDF_MAX_WORKERS, KDF_MAX_QUEUE)
+
+
+def configure_kdf_pool(max_workers=None, max_queue=None):
+    """Replace the shared KDF pool (e.g. from app config); counters start from zero."""
+    global _pool
+    old = _pool
+    _pool = _KDFPool(max_workers or old.max_workers, old.max_queue if max_queue is None else max_queue)
+    old.shutdown()
+
+
+def kdf_stats():
+    """Snapshot of the KDF pool's limits, current load and timing counters."""
+    return _pool.stats()
+
+
+# ===== Derived key cache (opt-in, 0 disables) =====
+KDF_CACHE_SIZE = int(os.getenv('KDF_CACHE_SIZE', 0))
+KDF_CACHE_TTL = float(os.getenv('KDF_CACHE_TTL', 300))
+
+
+class _KeyCache:
+    """LRU + TTL map from HMAC(password, salt) to derived key."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fingerprint(self, password, salt):
+        # Length prefix so (password, salt) pairs can't collide by shifting bytes across the boundary
+        msg = len(password).to_bytes(4, 'big') + password + salt
+        return hmac.new(self._secret, msg, hashlib.sha256).digest()
+
+    def get(self, fingerprint):
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(fingerprint)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[fingerprint]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, fingerprint, key):
+        with self._lock:
+            self._entries[fingerprint] = (key, time.monotonic() + self.ttl)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_cache = _KeyCache(KDF_CACHE_SIZE, KDF_CACHE_TTL)
+
+
+def _reset_after_fork():
+    # Worker processes inherit the pool object but not its threads (or a lock held mid-call)
+    global _pool, _cache
+    _pool = _KDFPool(_pool.max_workers, _pool.max_queue)
+    _cache = _KeyCache(_cache.max_size, _cache.ttl)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def configure_key_cache(max_size, ttl=None):
+    """Replace the derived key cache; max_size=0 turns it off. Counters start from zero."""
+    global _cache
+    _cache = _KeyCache(max_size, _cache.ttl if ttl is None else ttl)
+
+
+def key_cache_stats():
+    """Snapshot of the derived key cache's size and hit/miss/eviction counters."""
+    return _cache.stats()
+
+
+def parse_kdf(spec):
+    """
+    Validate a KDF spec ('pbkdf2:ITERATIONS' or 'scrypt:N:R:P', or the tuple
+    form) and return it as a tuple, e.g. ('scrypt', 16384, 8, 1).
+    """
+    if isinstance(spec, str):
+        name, *params = spec.strip().lower().split(':')
+        try:
+            spec = (name, *(int(p) for p in params))
+        except ValueError:
+            raise ValueError(f"Invalid KDF parameters: {spec}")
+    name, *params = spec
+    if name == 'pbkdf2' and len(params) == 1:
+        if not 1 <= params[0] <= MAX_PBKDF2_ITERATIONS:
+            raise ValueError(f"PBKDF2 iterations must be between 1 and {MAX_PBKDF2_ITERATIONS}")
+        return tuple(spec)
+    if name == 'scrypt' and len(params) == 3:
+        n, r, p = params
+        if n < 2 or n & (n - 1) or not 1 <= r <= 255 or not 1 <= p <= 255:
+            raise ValueError("scrypt needs N a power of two, and r and p between 1 and 255")
+        if 128 * n * r > MAX_SCRYPT_MEMORY:
+            raise ValueError("scrypt parameters need too much memory")
+        return tuple(spec)
+    raise ValueError(f"Unsupported KDF: {spec!r} (choose from {', '.join(KDFS)})")
+
+
+def pack_kdf(kdf):
+    """Descriptor bytes for a parsed KDF spec."""
+    if kdf[0] == 'pbkdf2':
+        return bytes([_KDF_IDS['pbkdf2']]) + kdf[1].to_bytes(4, 'big')
+    _, n, r, p = kdf
+    return bytes([_KDF_IDS['scrypt'], n.bit_length() - 1, r, p])
+
+
+def kdf_memory(kdf):
+    """Bytes a parsed KDF spec holds while it runs (scrypt's working memory; PBKDF2 needs next to none)."""
+    if kdf[0] == 'pbkdf2':
+        return 0
+    _, n, r, p = kdf
+    return 128 * n * r + 128 * r * p
+
+
+def _default_kdf():
+    try:
+        return parse_kdf(DEFAULT_KDF)
+    except ValueError:
+        return LEGACY_KDF
+
+
+def max_decode_iterations():
+    """Most PBKDF2 iterations a decoder accepts: KDF_MAX_DECODE_ITERATIONS, or the KDF setting's if higher."""
+    kdf = _default_kdf()
+    return max(KDF_MAX_DECODE_ITERATIONS, kdf[1] if kdf[0] == 'pbkdf2' else 0)
+
+
+def max_decode_memory():
+    """Most scrypt memory a decoder accepts: KDF_MAX_DECODE_SCRYPT_MB, or the KDF setting's if higher."""
+    return max(int(KDF_MAX_DECODE_SCRYPT_MB * 1024 * 1024), kdf_memory(_default_kdf()))
+
+
+def unpack_kdf(data):
+    """
+    Read a descriptor from the front of data; returns (kdf, bytes consumed).
+    Settings costlier than the decode limits are rejected before any work is done.
+    """
+    name = _KDF_NAMES.get(data[0]) if len(data) else None
+    if name == 'pbkdf2' and len(data) >= 5:
+        kdf, used = parse_kdf(('pbkdf2', int.from_bytes(bytes(data[1:5]), 'big'))), 5
+        if kdf[1] > max_decode_iterations():
+            raise KDFLimitError(f"This message uses {kdf[1]} PBKDF2 iterations, over this server's decode "
+                                f"limit of {max_decode_iterations()} (KDF_MAX_DECODE_ITERATIONS)")
+        return kdf, used
+    if name == 'scrypt' and len(data) >= 4 and data[1] < 64:
+        kdf, used = parse_kdf(('scrypt', 1 << data[1], data[2], data[3])), 4
+        if kdf_memory(kdf) > max_decode_memory():
+            raise KDFLimitError(f"This message needs {kdf_memory(kdf) / 2 ** 20:.1f} MB of scrypt memory, over "
+                                f"this server's decode limit of {max_decode_memory() / 2 ** 20:.1f} MB "
+                                f"(KDF_MAX_DECODE_SCRYPT_MB)")
+        return kdf, used
+    raise ValueError("Unknown key derivation settings")
+
+
+def _run_kdf(password, salt, kdf):
+    if kdf[0] == 'pbkdf2':
+        return hashlib.pbkdf2_hmac('sha256', password, salt, kdf[1], 32)
+    _, n, r, p = kdf
+    return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=129 * n * r + 128 * r * p, dklen=32)
+
+
+def derive_key(password, salt, cached=False, kdf=LEGACY_KDF):
+    """
+    Fernet-format (urlsafe base64) key for a password and salt, derived on the KDF pool.
+    kdf is a parsed spec (see parse_kdf); the default is the original PBKDF2 setting.
+    Decoders pass cached=True to reuse keys from the derived key cache when it is enabled.
+    """
+    password, salt = password.encode(), bytes(salt)
+    cache = _cache
+    if not cached or cache.max_size <= 0:
+        return base64.urlsafe_b64encode(_pool.run(_run_kdf, password, salt, kdf))
+    fingerprint = cache.fingerprint(password, salt + pack_kdf(kdf))
+    key = cache.get(fingerprint)
+    if key is None:
+        key = base64.urlsafe_b64encode(_pool.run(_run_kdf, password, salt, kdf))
+        cache.put(fingerprint, key)
+    return key
+
+def encrypt(data, password, cipher='fernet', kdf=LEGACY_KDF):
+    """
+    Encrypt bytes under a password, returning salt + ciphertext.
+    A kdf other than LEGACY_KDF is prefixed as a descriptor (see pack_kdf).
+    """
+    if cipher not in CIPHERS:
+        raise ValueError(f"Unsupported cipher: {cipher}")
+    kdf = parse_kdf(kdf)
+    prefix = b"" if kdf == LEGACY_KDF else pack_kdf(kdf)
+    salt = os.urandom(SALT_SIZE)
+    key = derive_key(password, salt, kdf=kdf)
+    if cipher == 'fernet':
+        return prefix + salt + Fernet(key).encrypt(data)
+    nonce = os.urandom(NONCE_SIZE)
+    return prefix + salt + nonce + AESGCM(base64.urlsafe_b64decode(key)).encrypt(nonce, data, None)
+
+def decrypt(payload, password, cipher='fernet', kdf_header=False):
+    """
+    Reverse encrypt(); raises on a wrong password or tampered data.
+    kdf_header says the payload starts with a KDF descriptor.
+    """
+    if cipher not in CIPHERS:
+        raise ValueError(f"Unsupported cipher: {cipher}")
+    kdf = LEGACY_KDF
+    if kdf_header:
+        kdf, used = unpack_kdf(payload)
+        payload = payload[used:]
+    salt = bytes(payload[:SALT_SIZE])
+    key = derive_key(password, salt, cached=True, kdf=kdf)
+    if cipher == 'fernet':
+        return Fernet(key).decrypt(bytes(payload[SALT_SIZE:]))
+    nonce = bytes(payload[SALT_SIZE:SALT_SIZE + NONCE_SIZE])
+    return AESGCM(base64.urlsafe_b64decode(key)).decrypt(nonce, bytes(payload[SALT_SIZE + NONCE_SIZE:]), None)
+
+
+@metrics.register_collector
+def _collect_metrics():
+    pool, cache = _pool.stats(), _cache.stats()
+    lookups = cache["hits"] + cache["misses"]
+    return [
+        ("stego_kdf_in_flight", "gauge", "Key derivations running or queued", pool["in_flight"]),
+        ("stego_kdf_calls_total", "counter", "Key derivations completed", pool["calls"]),
+        ("stego_kdf_rejected_total", "counter", "Key derivations refused because the queue was full", pool["rejected"]),
+        ("stego_key_cache_entries", "gauge", "Derived keys in the cache", cache["size"]),
+        ("stego_key_cache_hit_ratio", "gauge", "Derived key cache hits per lookup", cache["hits"] / lookups if lookups else 0),
+    ]
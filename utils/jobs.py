@@ -0,0 +1,150 @@
+"""
+In-process job queue for requests too slow to answer synchronously.
+
+A job wraps a callable run on a small thread pool (JOB_WORKERS threads, no
+external broker). Clients poll its status and progress, then fetch the
+result, which is kept for JOB_RESULT_TTL seconds after the job finishes.
+A job's inputs (e.g. uploads detached from the request) are closed as soon
+as it finishes; expired jobs are swept whenever the queue is used and their
+results closed then.
+
+A queue can be closed to new jobs (e.g. by a worker about to be recycled),
+which then waits until outstanding() is 0: every job's result or error has
+been handed to a client once, or has expired.
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', 300))
+
+
+class JobQueueClosedError(RuntimeError):
+    """Raised when submitting to a queue closed to new jobs."""
+
+
+class Job:
+    """One queued unit of work; status is queued, running, done or failed."""
+
+    def __init__(self, resources):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.progress = 0.0
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.collected = False  # the result or error has been sent to a client
+        self.lock = threading.Lock()
+        self._resources = list(resources)
+
+    def set_progress(self, fraction):
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+
+    def to_dict(self):
+        info = {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "created_at": self.created,
+        }
+        if self.finished is not None:
+            info["finished_at"] = self.finished
+        if self.error is not None:
+            info["error"] = self.error
+        return info
+
+    def close_inputs(self):
+        for resource in self._resources:
+            resource.close()
+        self._resources = []
+
+    def close(self):
+        """Release the inputs and the result."""
+        self.close_inputs()
+        if hasattr(self.result, 'close'):
+            self.result.close()
+
+
+class JobQueue:
+    """Runs jobs on a thread pool and keeps finished ones for `ttl` seconds."""
+
+    def __init__(self, max_workers=JOB_WORKERS, ttl=JOB_RESULT_TTL):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def submit(self, fn, resources=()):
+        """
+        Queue fn(job); its return value becomes job.result. `resources` (e.g.
+        uploads detached from the request) are closed once fn returns.
+        """
+        self.sweep()
+        job = Job(resources)
+        with self._lock:
+            if self.closed:
+                raise JobQueueClosedError("This worker is restarting and takes no new jobs; try again shortly")
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        job.status = 'running'
+        try:
+            job.result = fn(job)
+            job.progress = 1.0
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.close_inputs()
+            job.finished = time.time()
+
+    def get(self, job_id):
+        """The job with this id, or None if it never existed or has expired."""
+        self.sweep()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def sweep(self):
+        """Drop and close jobs that finished more than ttl seconds ago."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished is not None and job.finished < cutoff]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            with job.lock:
+                job.close()
+
+    def close(self):
+        """Refuse new jobs; the ones already queued still run and stay available."""
+        with self._lock:
+            self.closed = True
+
+    def outstanding(self):
+        """Jobs whose result or error no client has collected yet, expired ones aside."""
+        self.sweep()
+        with self._lock:
+            return sum(not job.collected for job in self._jobs.values())
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            jobs, self._jobs = list(self._jobs.values()), {}
+        for job in jobs:
+            job.close()
@@ -0,0 +1,84 @@
+"""
+Vectorized LSB helpers shared by the image and audio engines.
+
+Carriers are flat uint8 arrays (RGB channel values or PCM frame bytes).
+Each value carries k payload bits (k = 1..4) in its low bits, MSB first.
+Readers are callables `read(start, end)` returning carrier values
+[start, end), so callers can decode lazily.
+"""
+
+import numpy as np
+
+# Carrier values unpacked by the first scan pass (512 payload bytes); doubles on each pass
+SCAN_BLOCK_SIZE = 4096
+
+
+def to_bits(data):
+    """Unpack bytes into a flat uint8 array of 0/1 values, MSB first."""
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+MAX_BITS_PER_VALUE = 4
+
+
+def values_needed(nbits, k=1):
+    """Carrier values needed to hold nbits at k bits per value."""
+    return -(-nbits // k)
+
+
+def group_bits(bits, k=1):
+    """Fold a 0/1 bit array into one k-bit value per carrier value (zero padded), MSB first."""
+    if k == 1:
+        return bits
+    pad = (-len(bits)) % k
+    groups = np.concatenate([bits, np.zeros(pad, dtype=np.uint8)]).reshape(-1, k)
+    weights = (1 << np.arange(k - 1, -1, -1)).astype(np.uint8)
+    return (groups * weights).sum(axis=1, dtype=np.uint8)
+
+
+def embed_window(values, first, groups, start, k=1):
+    """
+    Write the part of `groups` (k-bit values destined for carrier positions
+    start, start+1, ...) that falls inside `values`, a window of the carrier
+    beginning at position `first`. Lets a carrier be embedded strip by strip.
+    """
+    lo = max(first, start)
+    hi = min(first + len(values), start + len(groups))
+    if lo < hi:
+        mask = 0xFF ^ ((1 << k) - 1)
+        values[lo - first:hi - first] = (values[lo - first:hi - first] & mask) | groups[lo - start:hi - start]
+
+
+def embed_bits(values, bits, offset=0, k=1):
+    """Write a 0/1 bit array into the k low bits of values[offset:] in place."""
+    groups = group_bits(bits, k)
+    if offset + len(groups) > len(values):
+        raise ValueError("Payload does not fit in carrier")
+    embed_window(values, 0, groups, offset, k)
+
+
+def embed_bytes(values, data, offset=0, k=1):
+    """Write the bits of `data` into the k low bits of values[offset:] in place."""
+    embed_bits(values, to_bits(data), offset, k)
+
+
+def read_bytes(read, start, nbytes, k=1):
+    """Pack `nbytes` bytes from the k low bits of carrier values starting at `start`."""
+    if k == 1:
+        return np.packbits(read(start, start + nbytes * 8) & 1).tobytes()
+    nbits = nbytes * 8
+    chunk = read(start, start + values_needed(nbits, k)) & ((1 << k) - 1)
+    # Expand every value to 8 bits and keep its k low ones, MSB first
+    bits = np.unpackbits(chunk[:, None], axis=1)[:, 8 - k:].reshape(-1)
+    return np.packbits(bits[:nbits]).tobytes()
+
+
+def iter_blocks(read, total, block_size=SCAN_BLOCK_SIZE):
+    """Yield packed LSBs of `total` carrier values in growing blocks (block_size values, then doubling)."""
+    total -= total % 8  # trailing bits never formed a whole byte
+    start = 0
+    while start < total:
+        end = min(start + block_size, total)
+        yield np.packbits(read(start, end) & 1).tobytes()
+        start = end
+        block_size *= 2
@@ -0,0 +1,213 @@
+"""
+Multi-core embedding, extraction and LSB rendering for very large images.
+
+Opt-in: with PARALLEL_WORKERS > 0, operations touching at least
+PARALLEL_MIN_PIXELS pixels copy the rows they span, strip by strip, into one
+multiprocessing.shared_memory block. Row ranges of that block go to a
+persistent pool of PARALLEL_WORKERS processes together with their carrier
+offset; workers map the block by name and work on it in place, so the raster
+is never pickled. A crashed worker fails the current operation only; the
+pool is rebuilt for the next one. Below the threshold, and inside worker processes (e.g.
+batch workers), callers keep the single-process strip engine.
+
+The shared block is one extra copy of the rows involved, which trades the
+strip engine's memory bound for cores. An embed bound for PNG is not copied
+back: write_png deflates the PNG straight from the block, also on the pool.
+Other output formats go through PIL, which keeps RGB at 4 bytes per pixel and
+so cannot wrap the packed block (Image.frombuffer copies it); those rows are
+pasted back with put_back. Run benchmarks/bench_parallel.py to find where the
+switch pays off on a given host.
+"""
+
+import multiprocessing
+import os
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from utils import lsb, pools, strips
+
+PARALLEL_WORKERS = int(os.getenv('PARALLEL_WORKERS', 0))
+PARALLEL_MIN_PIXELS = int(os.getenv('PARALLEL_MIN_PIXELS', 16_000_000))
+
+_workers = PARALLEL_WORKERS
+_min_pixels = PARALLEL_MIN_PIXELS
+_pool = pools.ProcessPool(max(PARALLEL_WORKERS, 1))
+
+
+def configure_parallel(workers=None, min_pixels=None):
+    """Change the worker count (0 disables) and threshold, e.g. from app config; stops the current pool."""
+    global _workers, _min_pixels
+    if workers is not None and workers != _workers:
+        _pool.resize(max(workers, 1))
+    _workers = _workers if workers is None else workers
+    _min_pixels = _min_pixels if min_pixels is None else min_pixels
+
+
+def enabled(nvalues):
+    """Whether an operation over nvalues channel values should run on the pool."""
+    return _workers > 0 and nvalues >= _min_pixels * 3 and multiprocessing.parent_process() is None
+
+
+class SharedRows:
+    """Rows [y0, y1) of an RGB image, copied strip by strip into shared memory."""
+
+    def __init__(self, img, y0, y1):
+        self.row_len = img.width * 3
+        self.y0, self.y1 = y0, y1
+        self.base = y0 * self.row_len
+        self.size = (y1 - y0) * self.row_len
+        self._shm = SharedMemory(create=True, size=max(self.size, 1))
+        values = self._view()
+        for y, band in strips.iter_strips(img, self.base, self.base + self.size):
+            offset = y * self.row_len - self.base
+            values[offset:offset + len(band)] = band
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _view(self):
+        return np.ndarray((self.size,), dtype=np.uint8, buffer=self._shm.buf)
+
+    def put_back(self, img):
+        """Write the (modified) rows back into the image."""
+        values = self._view()
+        step = strips.STRIP_HEIGHT * self.row_len
+        for offset in range(0, self.size, step):
+            strips.put_strip(img, self.y0 + offset // self.row_len, values[offset:offset + step])
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _rows_spanning(img, start, stop):
+    row_len = img.width * 3
+    return start // row_len, min(-(-stop // row_len), img.height)
+
+
+def _split(n, parts, align=8):
+    """Split [0, n) into up to `parts` ranges whose inner boundaries are multiples of align."""
+    bounds = sorted({min(n, i * n // parts // align * align) for i in range(parts)} | {n})
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+# ===== Worker side =====
+# Each task maps the block by name; `base` is the carrier position of its first value.
+
+def _embed_task(name, size, base, start, data, k):
+    shm = SharedMemory(name=name)
+    try:
+        values = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+        lsb.embed_window(values, base, lsb.group_bits(lsb.to_bits(data), k), start, k)
+        del values
+    finally:
+        shm.close()
+
+
+def _read_task(name, size, base, start, nbytes, k):
+    shm = SharedMemory(name=name)
+    try:
+        values = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+        data = lsb.read_bytes(lambda s, e: values[s - base:e - base], start, nbytes, k)
+        del values
+        return data
+    finally:
+        shm.close()
+
+
+def _deflate_task(name, size, offset, end, row_len, fn, level):
+    shm = SharedMemory(name=name)
+    try:
+        values = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+        result = strips.deflate_rows(fn(values[offset:end]), row_len, level)
+        del values
+        return result
+    finally:
+        shm.close()
+
+
+def _unchanged(values):
+    return values
+
+
+# ===== Parent side =====
+
+def embed_rows(img, segments):
+    """
+    Embed (start, data, k) segments into a shared copy of the rows they span:
+    the bits of data go into the k low bits of channel values start, start + 1, ...
+    Returns the SharedRows; the caller closes it after put_back or write_png.
+    """
+    spans = [(start, data, k, lsb.values_needed(len(data) * 8, k)) for start, data, k in segments]
+    y0, y1 = _rows_spanning(img, min(s[0] for s in spans), max(s[0] + s[3] for s in spans))
+    rows = SharedRows(img, y0, y1)
+    try:
+        futures = [
+            # Ranges start on multiples of 8 values, i.e. on whole payload bytes
+            _pool.submit(_embed_task, rows.name, rows.size, rows.base, start + a, data[a * k // 8:b * k // 8], k)
+            for start, data, k, nvalues in spans
+            for a, b in _split(nvalues, _workers)
+        ]
+        for future in futures:
+            future.result()
+    except BaseException:
+        rows.close()
+        raise
+    return rows
+
+
+def read_bytes(img, start, nbytes, k=1):
+    """Parallel lsb.read_bytes over the channel values of an RGB image."""
+    nvalues = lsb.values_needed(nbytes * 8, k)
+    y0, y1 = _rows_spanning(img, start, start + nvalues)
+    with SharedRows(img, y0, y1) as rows:
+        futures = [
+            _pool.submit(_read_task, rows.name, rows.size, rows.base, start + a,
+                            min(b * k // 8, nbytes) - a * k // 8, k)
+            for a, b in _split(nvalues, _workers)
+        ]
+        return b"".join(future.result() for future in futures)
+
+
+def _iter_deflated(rows, fn, level):
+    futures = [
+        _pool.submit(_deflate_task, rows.name, rows.size, a * rows.row_len, b * rows.row_len,
+                        rows.row_len, fn, level)
+        for a, b in _split(rows.y1 - rows.y0, _workers * 2, align=1)
+    ]
+    for future in futures:
+        yield future.result()
+
+
+def iter_deflated_rows(img, fn, level=6):
+    """
+    Yield strips.deflate_rows results for fn(rows), in row order, with the
+    image split into row ranges across the pool. fn maps a flat uint8 row
+    array to another and must be picklable (a module-level function).
+    """
+    with SharedRows(img, 0, img.height) as rows:
+        yield from _iter_deflated(rows, fn, level)
+
+
+def write_png(img, rows, fp, level=6):
+    """
+    Write img as an RGB PNG to fp, taking rows [rows.y0, rows.y1) from the
+    shared block (e.g. from embed_rows) instead of the image.
+    """
+    row_len = img.width * 3
+    writer = strips.PNGStripWriter(fp, img.width, img.height, level)
+    for _, band in strips.iter_strips(img, 0, rows.y0 * row_len):
+        writer.write(band)
+    for deflated in _iter_deflated(rows, _unchanged, level):
+        writer.write_deflated(*deflated)
+    for _, band in strips.iter_strips(img, rows.y1 * row_len):
+        writer.write(band)
+    writer.close()
@@ -0,0 +1,196 @@
+"""
+Text payload pipeline shared by the image and audio engines.
+
+Encoding runs UTF-8 -> optional compression -> optional encryption; each
+step is recorded in the container flags so decoders can reverse it without
+being told how the message was written.
+
+Decompression stops at MAX_MESSAGE_BYTES, so a few KB of hidden data can't
+expand into a message of hundreds of MB.
+"""
+
+import codecs
+import lzma
+import os
+import zlib
+
+from cryptography.fernet import Fernet
+
+from utils import container, crypto, metrics
+
+# ===== Optional zstd =====
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+COMPRESSIONS = ('zlib', 'lzma', 'zstd')
+
+MAX_MESSAGE_BYTES = int(os.getenv('MAX_MESSAGE_BYTES', 64 * 1024 * 1024))
+
+
+def compress(data, method):
+    if method == 'zlib':
+        return zlib.compress(data, 9)
+    if method == 'lzma':
+        return lzma.compress(data, preset=6)
+    if method == 'zstd':
+        if not ZSTD_AVAILABLE:
+            raise ValueError("zstd compression needs the 'zstandard' package")
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    raise ValueError(f"Unsupported compression: {method}")
+
+
+def decompress(data, method, limit=None):
+    """Decompress data, raising ValueError if the result would exceed limit (default MAX_MESSAGE_BYTES) bytes."""
+    limit = MAX_MESSAGE_BYTES if limit is None else limit
+    too_large = ValueError("Hidden data is corrupted (it expands past the maximum message size)")
+    if method == 'zlib':
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(data, limit + 1)
+        if len(data) > limit:
+            raise too_large
+        if not decompressor.eof:
+            raise zlib.error("incomplete or truncated stream")
+        return data
+    if method == 'lzma':
+        decompressor = lzma.LZMADecompressor()
+        data = decompressor.decompress(data, max_length=limit + 1)
+        if len(data) > limit:
+            raise too_large
+        if not decompressor.eof:
+            raise lzma.LZMAError("incomplete or truncated stream")
+        return data
+    if method == 'zstd':
+        if not ZSTD_AVAILABLE:
+            raise ValueError("This message is zstd compressed; install the 'zstandard' package to read it")
+        reader = zstandard.ZstdDecompressor().stream_reader(data)
+        chunks, size = [], 0
+        while size <= limit:
+            chunk = reader.read(limit + 1 - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        if size > limit:
+            raise too_large
+        return b"".join(chunks)
+    raise ValueError(f"Unsupported compression: {method}")
+
+
+def build_text(message, password=None, compression=None, cipher='fernet', kdf=None):
+    """
+    Return (payload, flags) for a text message, ready for container.pack().
+    kdf is a KDF spec such as 'scrypt:16384:8:1'; None uses crypto.DEFAULT_KDF.
+    """
+    data = message.encode('utf-8')
+    flags = 0
+
+    if compression:
+        with metrics.stage('compress'):
+            packed = compress(data, compression)
+        # Short or high-entropy messages can grow; only keep a real saving
+        if len(packed) < len(data):
+            data = packed
+            flags |= container.compression_flag(compression)
+
+    if password:
+        kdf = crypto.parse_kdf(kdf or crypto.DEFAULT_KDF)
+        with metrics.stage('encrypt'):
+            data = crypto.encrypt(data, password, cipher, kdf)
+        flags |= container.FLAG_ENCRYPTED
+        if kdf != crypto.LEGACY_KDF:
+            flags |= container.FLAG_KDF
+        if cipher == 'aesgcm':
+            flags |= container.FLAG_AEAD
+
+    return data, flags
+
+
+# Bytes of LSBs a probe reads: enough for any header and a legacy text prefix
+PROBE_BYTES = 64
+
+
+def decrypt_legacy(data, password):
+    """
+    Decrypt a pre-v2 b"ENC:" + salt + Fernet token payload, without its
+    terminator; ValueError on a wrong password.
+    """
+    salt = bytes(data[4:4 + crypto.SALT_SIZE])
+    key = crypto.derive_key(password, salt, cached=True)  # outside the try: a busy KDF pool is not a wrong password
+    try:
+        return Fernet(key).decrypt(bytes(data[4 + crypto.SALT_SIZE:])).decode()
+    except Exception:
+        raise ValueError("❌ Incorrect password or corrupted data.")
+
+
+def sniff_legacy(head, terminator):
+    """
+    Classify the first bytes of a pre-v2 payload for probes, in the same shape
+    as container.describe(): format is 'ENC:', 'IMG:' or 'text'. Returns None
+    when the bytes don't look like any payload. length is None when it isn't
+    known without reading further.
+    """
+    if head.startswith(b"ENC:"):
+        return {'format': 'ENC:', 'payload': 'text', 'encrypted': True, 'length': None}
+    if head.startswith(b"IMG:") and len(head) >= 12:
+        width, height = int.from_bytes(head[4:8], 'big'), int.from_bytes(head[8:12], 'big')
+        return {'format': 'IMG:', 'payload': 'image', 'encrypted': False, 'length': 12 + width * height * 3}
+    end = head.find(terminator)
+    text = head if end == -1 else head[:end]
+    try:
+        # Without a terminator the window may end mid-character; decode what's complete
+        decoded = codecs.getincrementaldecoder('utf-8')().decode(text, final=end != -1)
+    except UnicodeDecodeError:
+        return None
+    if not decoded or not decoded.replace('\n', '').replace('\t', '').isprintable():
+        return None
+    return {'format': 'text', 'payload': 'text', 'encrypted': False, 'length': None if end == -1 else end}
+
+
+def unpack_text(payload, flags, password=None):
+    """
+    Reverse build_text(). Raises ValueError carrying the user-facing status
+    string when the message can't be recovered.
+    """
+    if flags & container.FLAG_IMAGE:
+        raise ValueError("This file carries a hidden image, not a text message.")
+
+    data = payload
+    if flags & container.FLAG_ENCRYPTED:
+        if not password:
+            raise ValueError("🔒 This message is encrypted. Please provide a password.")
+        try:
+            with metrics.stage('decrypt'):
+                data = crypto.decrypt(data, password, 'aesgcm' if flags & container.FLAG_AEAD else 'fernet',
+                                      bool(flags & container.FLAG_KDF))
+        except crypto.KDFBusyError:
+            raise
+        except crypto.KDFLimitError as e:
+            raise ValueError(f"❌ {e}.")
+        except Exception:
+            raise ValueError("❌ Incorrect password or corrupted data.")
+
+    compression = container.compression_from_flags(flags)
+    if compression:
+        try:
+            with metrics.stage('decompress'):
+                data = decompress(data, compression)
+        except ValueError as e:
+            raise ValueError(f"❌ {e}.")
+        except Exception:
+            raise ValueError("❌ Hidden data is corrupted (decompression failed).")
+
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ValueError("Error decoding message (format mismatch).")
+
+
+def read_text(payload, flags, password=None):
+    """Reverse build_text(), returning the message or a user-facing status string."""
+    try:
+        return unpack_text(payload, flags, password)
+    except ValueError as e:
+        return str(e)
@@ -0,0 +1,64 @@
+"""
+Lazily started process pools that replace themselves once broken.
+
+A ProcessPoolExecutor whose worker dies (e.g. killed for running out of
+memory) is broken for good: every later submit() raises BrokenProcessPool.
+ProcessPool starts a fresh executor on the next submit instead, so one crash
+costs the tasks that were in flight, not every request until a restart.
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ProcessPool:
+    """A ProcessPoolExecutor of `workers` processes, started on first use and rebuilt after breaking."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def submit(self, fn, *args):
+        """
+        Submit to the pool. A pool found broken here is replaced and the task
+        submitted once more; one that breaks later is replaced as soon as a
+        future reports BrokenProcessPool (that future, and the others in flight,
+        fail with it).
+        """
+        executor = self.get()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self.discard(executor)
+            executor = self.get()
+            future = executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._check(f, executor))
+        return future
+
+    def _check(self, future, executor):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self.discard(executor)
+
+    def discard(self, executor):
+        """Drop a broken executor so the next submit starts a new one."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            # A broken executor has already stopped its workers; nothing to shut down
+            self._executor = None
+
+    def resize(self, workers):
+        """Change the worker count; the current executor finishes its tasks and a new one starts on demand."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.workers = workers
+        if executor is not None:
+            executor.shutdown()
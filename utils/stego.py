@@ -1,131 +1,447 @@
-from PIL import Image
-import base64
+from PIL import Image, features
+import numpy as np
+import io
 import os
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-
-def derive_key(password, salt):
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-    )
-    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+
+from utils import container, lsb, metrics, parallel, streams, strips, payload as text_payload
 
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-def encode_message(image_path, message, output_path, password=None):
-    img = Image.open(image_path).convert("RGB")  # Always convert to RGB to avoid channel issues
-    pixels = img.load()
-    width, height = img.size
+def _save(img, output_path):
+    """
+    Save the stego image with the source metadata.
+    With no output_path the encoded file is returned as bytes.
+    """
+    target = output_path if output_path is not None else io.BytesIO()
+    with metrics.stage('image_encode'):
+        img.save(target, format=_output_format(target))
+    if output_path is None:
+        return target.getvalue()
 
-    if password:
-        # Encryption Mode
-        salt = os.urandom(16)
-        key = derive_key(password, salt)
-        f = Fernet(key)
-        # Prefix with SALT + encrypted_message
-        encrypted_message = f.encrypt(message.encode())
-        # We need to store: [MAGIC_FLAG][SALT][Message] to know it's encrypted
-        # Let's say magic flag is "ENC:"
-        final_payload_bytes = b"ENC:" + salt + encrypted_message
-        
-        # Convert bytes to binary string
-        binary_message = ''.join(format(byte, '08b') for byte in final_payload_bytes)
-    else:
-        # Plaintext Mode
-        binary_message = ''.join(format(ord(char), '08b') for char in message)
-    
-    binary_message += '00000000'  # Null terminator
+def _save_shared(img, rows, output_path):
+    """
+    _save for an image whose embedded rows are still in a parallel.SharedRows.
+    A PNG is written straight from the shared block; other formats need them pasted back first.
+    """
+    target = output_path if output_path is not None else io.BytesIO()
+    with rows:
+        if _output_format(target) != 'PNG':
+            rows.put_back(img)
+            return _save(img, output_path)
+        with metrics.stage('image_encode'):
+            if isinstance(target, (str, os.PathLike)):
+                with open(target, 'wb') as f:
+                    parallel.write_png(img, rows, f)
+            else:
+                parallel.write_png(img, rows, target)
+    if output_path is None:
+        return target.getvalue()
 
-    if len(binary_message) > width * height * 3:
-        raise ValueError("Message too long for this image")
+def _channel_reader(img):
+    """Return read(start, end) over the flat channel values of an RGB image, copying only the rows spanned."""
+    row_len = img.width * 3
 
-    bit_index = 0
-    for y in range(height):
-        for x in range(width):
-            pixel = list(pixels[x, y])
-            for channel in range(3):
-                if bit_index < len(binary_message):
-                    pixel[channel] = (pixel[channel] & 0xFE) | int(binary_message[bit_index])
-                    bit_index += 1
-            pixels[x, y] = tuple(pixel)
-            if bit_index >= len(binary_message):
-                break
+    def read(start, end):
+        y0 = start // row_len
+        y1 = -(-end // row_len)
+        rows = np.frombuffer(img.crop((0, y0, img.width, y1)).tobytes(), dtype=np.uint8)
+        offset = start - y0 * row_len
+        return rows[offset:offset + end - start]
+
+    return read
+
+def _payload_capacity(total_channels, k):
+    """Payload bytes that fit after the 1-bit container header at k bits per channel."""
+    return max(total_channels - container.HEADER_SIZE * 8, 0) * k // 8
+
+def _choose_bits(total_channels, nbytes, bits_per_channel):
+    """
+    Resolve bits_per_channel (1-4, or 'auto') for an nbytes payload.
+    'auto' picks the smallest k that fits, or the maximum if nothing does.
+    """
+    if bits_per_channel == 'auto':
+        for k in range(1, lsb.MAX_BITS_PER_VALUE + 1):
+            if _payload_capacity(total_channels, k) >= nbytes:
+                return k
+        return lsb.MAX_BITS_PER_VALUE
+    k = int(bits_per_channel)
+    if not 1 <= k <= lsb.MAX_BITS_PER_VALUE:
+        raise ValueError(f"Bits per channel must be between 1 and {lsb.MAX_BITS_PER_VALUE}, or 'auto'")
+    return k
+
+def _embed_container(img, payload, flags, k, output_path):
+    """
+    Embed header (1 bit per channel) + payload (k bits per channel) into img and save it.
+    Only the rows that carry the payload are touched, one strip at a time.
+    """
+    data = container.pack(payload, flags | container.bits_flag(k))
+    header_bits = lsb.to_bits(data[:container.HEADER_SIZE])
+    payload_groups = lsb.group_bits(lsb.to_bits(data[container.HEADER_SIZE:]), k)
+    used = len(header_bits) + len(payload_groups)
+    if used > img.width * img.height * 3:
+        raise ValueError("Payload does not fit in carrier")
+
+    rows = None
+    with metrics.stage('lsb_embed'):
+        if parallel.enabled(used):
+            rows = parallel.embed_rows(img, [(0, data[:container.HEADER_SIZE], 1),
+                                             (len(header_bits), data[container.HEADER_SIZE:], k)])
         else:
-            continue
-        break
+            # Strips are flat R,G,B,R,G,B... buffers in row-major pixel order
+            for y, band in strips.iter_strips(img, 0, used):
+                first = y * img.width * 3
+                lsb.embed_window(band, first, header_bits, 0)
+                lsb.embed_window(band, first, payload_groups, len(header_bits), k)
+                strips.put_strip(img, y, band)
+    if rows is not None:
+        return _save_shared(img, rows, output_path)
+    return _save(img, output_path)
 
-    img.save(output_path)
+def _read_container(img):
+    """
+    Read a v2 container from the image LSBs.
+    Returns (header, payload), or (None, None) if the image has no v2 header.
+    """
+    read = _channel_reader(img)
+    total_channels = img.width * img.height * 3
+    if total_channels < container.HEADER_SIZE * 8:
+        return None, None
+    header = container.parse_header(lsb.read_bytes(read, 0, container.HEADER_SIZE))
+    if header is None:
+        return None, None
+    k = container.bits_from_flags(header.flags)
+    if header.length > _payload_capacity(total_channels, k):
+        raise ValueError("Hidden data is corrupted (declared length exceeds image capacity)")
+    with metrics.stage('lsb_extract'):
+        if parallel.enabled(lsb.values_needed(header.length * 8, k)):
+            payload = parallel.read_bytes(img, container.HEADER_SIZE * 8, header.length, k)
+        else:
+            payload = lsb.read_bytes(read, container.HEADER_SIZE * 8, header.length, k)
+    container.verify(header, payload)
+    return header, payload
 
-def decode_message(image_path, password=None):
-    img = Image.open(image_path).convert("RGB")  # Always convert to RGB for consistent channel access
-    pixels = img.load()
+def _read_legacy_text(img):
+    """Scan for a pre-v2, null-terminated payload."""
+    # Unpack LSBs block by block and stop at the null terminator, so the
+    # work scales with the message rather than with the image.
+    all_bytes = bytearray()
+    with metrics.stage('lsb_extract'):
+        for block in lsb.iter_blocks(_channel_reader(img), img.width * img.height * 3):
+            search_from = len(all_bytes)
+            all_bytes += block
+            if all_bytes.startswith(b"ENC:"):
+                # The random salt may contain null bytes; the terminator comes after it
+                search_from = max(search_from, 20)
+            end = all_bytes.find(b"\x00", search_from)
+            if end != -1:
+                del all_bytes[end:]
+                break
+    return all_bytes
+
+def encode_message(image_path, message, output_path=None, password=None, compression=None, cipher='fernet',
+                   bits_per_channel=1, kdf=None):
+    """
+    Hide a text message in an image.
+    compression ('zlib', 'lzma', 'zstd') is applied before encryption; cipher
+    'aesgcm' stores raw AES-GCM ciphertext instead of a base64 Fernet token.
+    bits_per_channel (1-4, or 'auto' for the smallest that fits) trades
+    invisibility for capacity. kdf overrides the deployment's key derivation
+    setting (crypto.DEFAULT_KDF), e.g. 'scrypt:16384:8:1'.
+    Sources may be paths, bytes or file objects; with no output_path the
+    stego image is returned as PNG bytes.
+    """
+    payload, flags = text_payload.build_text(message, password, compression, cipher, kdf)
+    return embed_text_payload(image_path, payload, flags, output_path, bits_per_channel)
+
+def embed_text_payload(image_path, payload, flags, output_path=None, bits_per_channel=1):
+    """
+    Embed a payload already built by utils.payload.build_text. Lets a batch
+    build (and encrypt) one payload and embed it in many covers.
+    """
+    img = strips.open_rgb(streams.as_source(image_path))  # Always RGB to avoid channel issues
     width, height = img.size
 
-    binary_message = []
-    for y in range(height):
-        for x in range(width):
-            pixel = pixels[x, y]
-            for channel in range(3):
-                binary_message.append(str(pixel[channel] & 1))
+    k = _choose_bits(width * height * 3, len(payload), bits_per_channel)
 
-    # Convert binary to bytes
-    all_bytes = bytearray()
-    for i in range(0, len(binary_message), 8):
-        byte_str = binary_message[i:i+8]
-        if byte_str == ['0']*8:
-            break
-        all_bytes.append(int(''.join(byte_str), 2))
-    
-    # Try to detect if encrypted
-    # Format: b"ENC:" + 16 bytes salt + ciphertext
+    if len(payload) > _payload_capacity(width * height * 3, k):
+        raise ValueError("Message too long for this image")
+
+    return _embed_container(img, payload, flags, k, output_path)
+
+def decode_message(image_path, password=None):
+    img = strips.open_rgb(streams.as_source(image_path))  # Always RGB for consistent channel access
+
+    try:
+        header, payload = _read_container(img)
+    except ValueError as e:
+        return f"❌ {e}."
+
+    if header is not None:
+        return text_payload.read_text(payload, header.flags, password)
+
+    # Backward compatibility: null-terminated payload, b"ENC:" + 16 bytes salt + ciphertext if encrypted
+    all_bytes = _read_legacy_text(img)
     if all_bytes.startswith(b"ENC:"):
         if not password:
             return "🔒 This message is encrypted. Please provide a password."
-        
         try:
-            salt = bytes(all_bytes[4:20])
-            ciphertext = bytes(all_bytes[20:])
-            
-            key = derive_key(password, salt)
-            f = Fernet(key)
-            decrypted_message = f.decrypt(ciphertext)
-            return decrypted_message.decode()
-        except Exception:
-            return "❌ Incorrect password or corrupted data."
+            return text_payload.decrypt_legacy(all_bytes, password)
+        except ValueError as e:
+            return str(e)
     else:
-        # Backward compatibility for old plain text messages
         try:
             return all_bytes.decode('utf-8')
         except UnicodeDecodeError:
             # Fallback for old character-by-character logic if bytes fail (rare)
             return "Error decoding message (format mismatch)."
 
+def inspect_message(image_path, password=None):
+    """
+    Structured variant of decode_message for scanning many files. Returns a dict
+    with has_payload, encrypted and either text or error (no text and no error
+    when the message is encrypted and no password was given).
+    Pre-v2 plaintext has no marker, so it only counts as a payload when the
+    bytes before the terminator are non-empty printable UTF-8.
+    """
+    img = strips.open_rgb(streams.as_source(image_path))
+
+    try:
+        header, payload = _read_container(img)
+    except ValueError as e:
+        return {"has_payload": True, "encrypted": False, "error": str(e)}
+
+    if header is not None:
+        result = {"has_payload": True, "encrypted": bool(header.flags & container.FLAG_ENCRYPTED)}
+        if result["encrypted"] and not password:
+            return result
+        try:
+            result["text"] = text_payload.unpack_text(payload, header.flags, password)
+        except ValueError as e:
+            result["error"] = str(e)
+        return result
+
+    all_bytes = _read_legacy_text(img)
+    if all_bytes.startswith(b"ENC:"):
+        result = {"has_payload": True, "encrypted": True}
+        if password:
+            try:
+                result["text"] = text_payload.decrypt_legacy(all_bytes, password)
+            except ValueError as e:
+                result["error"] = str(e)
+        return result
+    try:
+        text = all_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        text = ""
+    if text and text.replace('\n', '').replace('\t', '').isprintable():
+        return {"has_payload": True, "encrypted": False, "text": text}
+    return {"has_payload": False, "encrypted": False}
+
+# Lossy formats scramble the LSBs, so they never carry a payload (WebP can be either)
+LOSSY_FORMATS = ('JPEG', 'MPO')
+
+def _webp_is_lossless(fp):
+    """Walk a WebP file's RIFF chunks to its image data: VP8L is lossless, VP8 lossy."""
+    position = fp.tell()
+    try:
+        fp.seek(12)
+        while True:
+            chunk = fp.read(8)
+            if len(chunk) < 8:
+                return False
+            kind, size = chunk[:4], int.from_bytes(chunk[4:], 'little')
+            if kind in (b'VP8L', b'VP8 '):
+                return kind == b'VP8L'
+            fp.seek(size + (size & 1), 1)  # chunks are padded to even sizes
+    finally:
+        fp.seek(position)
+
+def _png_head(img, rows):
+    """
+    Decode only the first rows of a non-interlaced PNG by shrinking its decode
+    target: the zlib decoder stops once those rows are filled. This relies on
+    PIL internals (Image.tile, Image._size); returns None if they don't behave.
+    """
+    try:
+        tile = img.tile[0]
+        extents = (0, 0, img.width, rows)
+        img.tile = [tile._replace(extents=extents) if hasattr(tile, '_replace') else (tile[0], extents) + tuple(tile[2:])]
+        img._size = (img.width, rows)
+        head = img.convert("RGB")
+    except Exception:
+        return None
+    return head if head.size == extents[2:] else None
+
+def _open_head(image_path, nvalues):
+    """
+    Open an image as RGB, decoding only the rows holding its first `nvalues`
+    channel values where the format allows (non-interlaced PNG); other lossless
+    formats are decoded in full. Returns (head image, full width, full height);
+    the head image is None for lossy images (JPEG, lossy WebP), which are not
+    decoded at all.
+    """
+    source = streams.as_source(image_path)
+    img = Image.open(source)
+    width, height = img.size
+    if img.format in LOSSY_FORMATS or (img.format == 'WEBP' and not _webp_is_lossless(img.fp)):
+        return None, width, height
+    rows = min(height, -(-nvalues // (width * 3)))
+    if img.format == 'PNG' and not img.info.get('interlace') and len(img.tile) == 1:
+        head = _png_head(img, rows)
+        if head is not None:
+            return head, width, height
+        # Fall back to a full decode from a fresh image
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        img = Image.open(source)
+    return img.crop((0, 0, width, rows)).convert("RGB"), width, height
+
+def probe_image(image_path):
+    """
+    Report whether an image carries a payload, and which kind, from its first
+    text_payload.PROBE_BYTES bytes of LSBs: format ('v2', 'ENC:', 'IMG:', 'text' or None),
+    payload ('text' / 'image'), encrypted and the declared length (None if
+    unknown). Only the first pixel rows are decoded, and lossy formats not at all.
+    """
+    head_img, width, height = _open_head(image_path, text_payload.PROBE_BYTES * 8)
+    if head_img is None:
+        return {'format': None, 'payload': None, 'encrypted': False, 'length': None}
+    available = head_img.width * head_img.height * 3 // 8
+    read = _channel_reader(head_img)
+    head = lsb.read_bytes(read, 0, min(text_payload.PROBE_BYTES, available))
+
+    try:
+        header = container.parse_header(head)
+    except ValueError as e:
+        return {'format': 'v2', 'payload': None, 'encrypted': None, 'length': None, 'error': str(e)}
+    if header is not None:
+        result = container.describe(header)
+        head_values = head_img.width * head_img.height * 3
+        if header.flags & container.FLAG_IMAGE and head_values >= container.HEADER_SIZE * 8 + 32:
+            tag = lsb.read_bytes(read, container.HEADER_SIZE * 8, 4, result['bits_per_channel'])
+            result['image_encoding'] = 'encoded' if tag == IMZ_TAG else 'raw'
+        if header.length > _payload_capacity(width * height * 3, result['bits_per_channel']):
+            result['error'] = "Declared length exceeds image capacity"
+        return result
+
+    return text_payload.sniff_legacy(head, b"\x00") or \
+        {'format': None, 'payload': None, 'encrypted': False, 'length': None}
+
 def calculate_capacity(image_path):
-    img = Image.open(image_path).convert("RGB")  # Convert to RGB to get accurate capacity
+    """
+    Capacity of an image from its header alone: Image.open is lazy, so no
+    pixels are decoded. Encoders convert to RGB, so every mode counts 3 channels.
+    """
+    img = Image.open(streams.as_source(image_path))
     width, height = img.size
     max_bits = width * height * 3
     max_bytes = max_bits // 8
     return {
         'width': width,
         'height': height,
+        'mode': img.mode,
+        'format': img.format,
         'pixels': width * height,
         'max_bits': max_bits,
         'max_bytes': max_bytes,
-        'max_chars': max_bytes - 1  # Subtract 1 for null terminator
+        'max_chars': _payload_capacity(max_bits, 1),  # After the payload header
+        # Same figures for each k-LSB mode
+        'bits_per_channel': {
+            k: {
+                'max_bits': max_bits * k,
+                'max_bytes': max_bits * k // 8,
+                'max_chars': _payload_capacity(max_bits, k)
+            }
+            for k in range(1, lsb.MAX_BITS_PER_VALUE + 1)
+        }
     }
 
-def encode_image_in_image(cover_path, secret_path, output_path):
-    cover = Image.open(cover_path)
-    secret = Image.open(secret_path)
-    
-    # Calculate max size for secret image (same logic as text, 1 bit per channel)
-    cover_width, cover_height = cover.size
-    max_secret_pixels = (cover_width * cover_height * 3) // 8  # bits -> bytes
+# "IMG:" + 4 bytes width + 4 bytes height
+IMG_HEADER_SIZE = 12
+
+# "IMZ:" + an encoded PNG / WebP / JPEG file
+IMZ_TAG = b"IMZ:"
+SECRET_FORMATS = {'png': 'PNG', 'webp': 'WEBP', 'jpeg': 'JPEG', 'jpg': 'JPEG'}
+
+def _output_format(output_path):
+    """PIL format name for an output path or named file object, PNG if the extension is unknown."""
+    ext = os.path.splitext(streams.output_name(output_path))[1].lower()
+    return Image.registered_extensions().get(ext, 'PNG')
+
+def _save_secret(extracted_bytes, secret_w, secret_h, output_path):
+    fmt = _output_format(output_path)
+    with metrics.stage('image_encode'):
+        Image.frombytes('RGB', (secret_w, secret_h), extracted_bytes).save(output_path, format=fmt)
+    return fmt.lower()
+
+def _sniff_format(data):
+    """Identify an encoded secret from its magic bytes."""
+    if data.startswith(b"\x89PNG"):
+        return 'png'
+    if data.startswith(b"\xff\xd8"):
+        return 'jpeg'
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return 'webp'
+    raise ValueError("Hidden image has an unknown format")
+
+def _encode_secret(secret, secret_format, quality, max_bytes):
+    """Encode the secret as PNG / WebP / JPEG bytes no larger than max_bytes, downscaling if needed."""
+    fmt = SECRET_FORMATS.get(secret_format.lower())
+    if fmt is None:
+        raise ValueError(f"Unsupported secret image format: {secret_format}")
+    if fmt == 'WEBP' and not features.check('webp'):
+        raise ValueError("WebP support is not available in this Pillow build")
+    if max_bytes <= 0:
+        raise ValueError("Cover image is too small to hide the secret image")
+
+    secret = secret.convert('RGBA' if fmt != 'JPEG' and 'A' in secret.getbands() else 'RGB')
+    options = {} if fmt == 'PNG' else {'quality': quality}
+    while True:
+        buf = io.BytesIO()
+        secret.save(buf, format=fmt, **options)
+        if buf.tell() <= max_bytes:
+            return buf.getvalue()
+        # Encoded size scales roughly with pixel count
+        ratio = (max_bytes / buf.tell()) ** 0.5 * 0.9
+        new_w = int(secret.width * ratio)
+        new_h = int(secret.height * ratio)
+        if new_w < 1 or new_h < 1:
+            raise ValueError("Cover image is too small to hide the secret image")
+        secret = secret.resize((new_w, new_h))
+
+def encode_image_in_image(cover_path, secret_path, output_path=None, secret_format=None, quality=85,
+                          bits_per_channel=1):
+    """
+    Hide the secret image inside the cover image.
+    By default the secret is stored as raw RGB pixels behind an IMG: header.
+    With secret_format='png', 'webp' or 'jpeg' it is stored as an encoded file
+    behind an IMZ: header (quality applies to WebP/JPEG), so far larger secrets fit.
+    bits_per_channel works as in encode_message; the secret is only downscaled
+    if it does not fit at the chosen (or, for 'auto', the maximum) setting.
+    With no output_path the stego image is returned as PNG bytes.
+    """
+    cover = Image.open(streams.as_source(cover_path))
+    secret = Image.open(streams.as_source(secret_path))
+    total_channels = cover.width * cover.height * 3
+
+    if secret_format:
+        max_k = _choose_bits(total_channels, float('inf'), bits_per_channel)
+        budget = _payload_capacity(total_channels, max_k) - len(IMZ_TAG)
+        with metrics.stage('secret_encode'):
+            payload = IMZ_TAG + _encode_secret(secret, secret_format, quality, budget)
+    else:
+        needed = IMG_HEADER_SIZE + secret.width * secret.height * 3
+        k = _choose_bits(total_channels, needed, bits_per_channel)
+        payload = _raw_secret_payload(secret, _payload_capacity(total_channels, k))
+    k = _choose_bits(total_channels, len(payload), bits_per_channel)
+
+    if cover.mode != 'RGB':
+        cover = cover.convert('RGB')
+    return _embed_container(cover, payload, container.FLAG_IMAGE, k, output_path)
+
+def _raw_secret_payload(secret, max_secret_bytes):
+    """IMG: header + raw RGB pixels, resizing the secret to fit max_secret_bytes."""
     # approx max square size: sqrt(max_bytes / 3) / 8... simplify:
     
     # Resize secret image to be small enough. 
@@ -137,137 +453,68 @@ def encode_image_in_image(cover_path, secret_path, output_path):
     # No, 1 cover pixel has 3 basic updates (LSB R, G, B) = 3 bits capacity.
     # So 1 secret pixel (24 bits) needs 8 cover pixels (8 * 3 = 24).
     
-    max_pixels = (cover_width * cover_height) // 8
+    # The IMG: header takes a few bytes off that budget.
+    max_pixels = (max_secret_bytes - IMG_HEADER_SIZE) // 3
+    if max_pixels <= 0:
+        raise ValueError("Cover image is too small to hide the secret image")
     
     if secret.width * secret.height > max_pixels:
         # Resize secret
         ratio = (max_pixels / (secret.width * secret.height)) ** 0.5
         new_w = int(secret.width * ratio * 0.9)
         new_h = int(secret.height * ratio * 0.9)
+        if new_w < 1 or new_h < 1:
+            raise ValueError("Cover image is too small to hide the secret image")
         secret = secret.resize((new_w, new_h))
     
     secret = secret.convert('RGB')
-    cover = cover.convert('RGB')
-    
-    secret_pixels = secret.load()
-    cover_pixels = cover.load()
     
-    # Header: "IMG:" + 4 bytes width + 4 bytes height
+    # Header: "IMG:" + 4 bytes width + 4 bytes height, followed by the raw RGB pixels
     w_bytes = secret.width.to_bytes(4, 'big')
     h_bytes = secret.height.to_bytes(4, 'big')
     header = b"IMG:" + w_bytes + h_bytes
-    
-    # Convert header + secret pixels to bits
-    bits = []
-    
-    # Header bits
-    for byte in header:
-        for i in range(8):
-            bits.append((byte >> (7 - i)) & 1)
-            
-    # Secret Image bits
-    for y in range(secret.height):
-        for x in range(secret.width):
-            r, g, b = secret_pixels[x, y]
-            for val in (r, g, b):
-                for i in range(8):
-                    bits.append((val >> (7 - i)) & 1)
-                    
-    # Embed
-    bit_idx = 0
-    total_bits = len(bits)
-    
-    for y in range(cover_height):
-        for x in range(cover_width):
-            r, g, b = cover_pixels[x, y]
-            
-            if bit_idx < total_bits:
-                r = (r & 0xFE) | bits[bit_idx]
-                bit_idx += 1
-            if bit_idx < total_bits:
-                g = (g & 0xFE) | bits[bit_idx]
-                bit_idx += 1
-            if bit_idx < total_bits:
-                b = (b & 0xFE) | bits[bit_idx]
-                bit_idx += 1
-                
-            cover_pixels[x, y] = (r, g, b)
-            
-            if bit_idx >= total_bits:
-                break
-        else:
-            continue
-        break
-        
-    cover.save(output_path)
+    return header + secret.tobytes()
 
 
 def decode_image_from_image(image_path, output_path):
-    img = Image.open(image_path)
-    img = img.convert('RGB')
-    pixels = img.load()
-    width, height = img.size
-    
-    bits = []
-    
-    # Extract all bits (this is inefficient for huge images, but okay for MVP)
-    # Be careful with memory. We only need enough for header first!
-    
-    extracted_bytes = bytearray()
-    byte_builder = 0
-    bit_count = 0
-    
-    state = "HEADER" # HEADER, PIXELS
-    secret_w = 0
-    secret_h = 0
-    expected_bytes = 0
-    
-    # header is 4 ("IMG:") + 4 (W) + 4 (H) = 12 bytes
-    HEADER_SIZE = 12
-    
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            for val in (r, g, b):
-                byte_builder = (byte_builder << 1) | (val & 1)
-                bit_count += 1
-                
-                if bit_count == 8:
-                    extracted_bytes.append(byte_builder)
-                    byte_builder = 0
-                    bit_count = 0
-                    
-                    if state == "HEADER" and len(extracted_bytes) == HEADER_SIZE:
-                        if extracted_bytes[:4] != b"IMG:":
-                             raise ValueError("No hidden image found (Magic Header missing)")
-                        
-                        secret_w = int.from_bytes(extracted_bytes[4:8], 'big')
-                        secret_h = int.from_bytes(extracted_bytes[8:12], 'big')
-                        expected_bytes = secret_w * secret_h * 3
-                        state = "PIXELS"
-                        extracted_bytes = bytearray() # Reset for pixel data
-                        
-                    elif state == "PIXELS" and len(extracted_bytes) >= expected_bytes:
-                         # Done!
-                         secret_img = Image.new('RGB', (secret_w, secret_h))
-                         secret_pixels = secret_img.load()
-                         idx = 0
-                         for sy in range(secret_h):
-                             for sx in range(secret_w):
-                                 r = extracted_bytes[idx]
-                                 g = extracted_bytes[idx+1]
-                                 b = extracted_bytes[idx+2]
-                                 secret_pixels[sx, sy] = (r, g, b)
-                                 idx += 3
-                         
-                         secret_img.save(output_path)
-                         return True
-                         
-            if state == "PIXELS" and len(extracted_bytes) >= expected_bytes:
-                break
-        if state == "PIXELS" and len(extracted_bytes) >= expected_bytes:
-            break
+    """
+    Extract a hidden image to output_path (a path or writable file object)
+    and return its format ('png', 'webp', 'jpeg', ...).
+    Encoded (IMZ:) secrets are written out exactly as embedded; raw (IMG:)
+    secrets are saved in the format implied by output_path.
+    """
+    img = strips.open_rgb(streams.as_source(image_path))
 
-    if state != "PIXELS" or len(extracted_bytes) < expected_bytes:
-         raise ValueError("Incomplete data or image too noisy")
+    header, payload = _read_container(img)
+    if header is not None:
+        if not header.flags & container.FLAG_IMAGE:
+            raise ValueError("No hidden image found (Magic Header missing)")
+        if payload.startswith(IMZ_TAG):
+            encoded = memoryview(payload)[len(IMZ_TAG):]
+            fmt = _sniff_format(bytes(encoded[:12]))
+            streams.write_bytes(encoded, output_path)
+            return fmt
+        if not payload.startswith(b"IMG:"):
+            raise ValueError("No hidden image found (Magic Header missing)")
+        secret_w = int.from_bytes(payload[4:8], 'big')
+        secret_h = int.from_bytes(payload[8:12], 'big')
+        if len(payload) != IMG_HEADER_SIZE + secret_w * secret_h * 3:
+            raise ValueError("Incomplete data or image too noisy")
+        return _save_secret(memoryview(payload)[IMG_HEADER_SIZE:], secret_w, secret_h, output_path)
 
+    # Backward compatibility: bare IMG: header written before the v2 container
+    read = _channel_reader(img)
+    capacity = img.width * img.height * 3 // 8
+    if capacity < IMG_HEADER_SIZE:
+        raise ValueError("No hidden image found (Magic Header missing)")
+    legacy_header = lsb.read_bytes(read, 0, IMG_HEADER_SIZE)
+    if legacy_header[:4] != b"IMG:":
+        raise ValueError("No hidden image found (Magic Header missing)")
+    
+    secret_w = int.from_bytes(legacy_header[4:8], 'big')
+    secret_h = int.from_bytes(legacy_header[8:12], 'big')
+    expected_bytes = secret_w * secret_h * 3
+    if expected_bytes > capacity - IMG_HEADER_SIZE:
+        raise ValueError("Incomplete data or image too noisy")
+    
+    return _save_secret(lsb.read_bytes(read, IMG_HEADER_SIZE * 8, expected_bytes), secret_w, secret_h, output_path)
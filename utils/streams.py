@@ -0,0 +1,61 @@
+"""
+Input/output helpers so the engines work on paths, bytes or file objects.
+
+Every encode/decode function accepts a filesystem path, raw bytes or a
+readable file object as its source. Outputs may be a path or a writable
+file object; encoders given no output return the result as bytes.
+"""
+
+import io
+import os
+import tempfile
+
+# Size above which SpooledBuffer moves its contents to a temporary file
+SPOOL_THRESHOLD = int(os.getenv('SPOOL_THRESHOLD', 10 * 1024 * 1024))
+
+
+class SpooledBuffer(tempfile.SpooledTemporaryFile):
+    """
+    In-memory buffer that spills to disk only past max_size bytes.
+    fileno() is hidden because PIL asks for it when saving, which would
+    otherwise force every buffer onto disk.
+    """
+
+    def __init__(self, max_size=None):
+        super().__init__(max_size=SPOOL_THRESHOLD if max_size is None else max_size, mode='w+b')
+
+    def fileno(self):
+        raise io.UnsupportedOperation("fileno")
+
+
+def as_source(src):
+    """Paths and file objects pass through; bytes-like input is wrapped in a BytesIO."""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return io.BytesIO(src)
+    return src
+
+
+def output_name(output):
+    """File name used to pick an output format: the path itself or a file object's name."""
+    if isinstance(output, (str, os.PathLike)):
+        return os.fspath(output)
+    name = getattr(output, 'name', None)
+    return name if isinstance(name, str) else ''
+
+
+def write_bytes(data, output):
+    """Write raw bytes to a path or a writable file object."""
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, 'wb') as f:
+            f.write(data)
+    else:
+        output.write(data)
+
+
+def read_all(src):
+    """Return the full contents of a path or file object (read from the start)."""
+    if isinstance(src, (str, os.PathLike)):
+        with open(src, 'rb') as f:
+            return f.read()
+    src.seek(0)
+    return src.read()
@@ -0,0 +1,129 @@
+"""
+Strip (horizontal band) processing for very large images.
+
+Embedding, extraction and LSB visualization walk the decoded image
+STRIP_HEIGHT rows at a time instead of copying the whole raster into NumPy,
+so their working set beyond the decoded source is a few bands. PIL decodes
+the source in one go, so the source raster itself remains the floor.
+
+PNGStripWriter writes an RGB PNG band by band, for outputs that are built
+from scratch (the LSB visualization) and never need a second full raster.
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from utils import metrics
+
+STRIP_HEIGHT = int(os.getenv('STRIP_HEIGHT', 256))
+
+
+def open_rgb(src):
+    """
+    Open an image as RGB. Unlike a bare convert("RGB"), an image that already
+    is RGB is returned as is rather than copied.
+    """
+    img = Image.open(src)
+    with metrics.stage('image_decode'):
+        img.load()
+        return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+def iter_strips(img, start=0, stop=None, height=None):
+    """
+    Yield (first row, flat writable uint8 array) for bands of `height` rows
+    covering the channel values [start, stop) of an RGB image.
+    """
+    height = height or STRIP_HEIGHT
+    row_len = img.width * 3
+    stop = img.height * row_len if stop is None else stop
+    y = start // row_len
+    y_end = min(-(-stop // row_len), img.height)
+    while y < y_end:
+        y1 = min(y + height, y_end)
+        yield y, np.frombuffer(bytearray(img.crop((0, y, img.width, y1)).tobytes()), dtype=np.uint8)
+        y = y1
+
+
+def put_strip(img, y, band):
+    """Write a band from iter_strips back into the image at row y."""
+    rows = len(band) // (img.width * 3)
+    img.paste(Image.frombuffer("RGB", (img.width, rows), band, "raw", "RGB", 0, 1), (0, y))
+
+
+def filter_rows(band, row_len):
+    """PNG-filter whole rows (a flat or 2-D uint8 array, row_len values per row) with Sub filtering."""
+    rows = np.asarray(band, dtype=np.uint8).reshape(-1, row_len)
+    # Filter type 1 (Sub): each byte minus the same channel of the pixel to its left
+    filtered = np.empty((len(rows), row_len + 1), dtype=np.uint8)
+    filtered[:, 0] = 1
+    filtered[:, 1:4] = rows[:, :3]
+    filtered[:, 4:] = rows[:, 3:] - rows[:, :-3]
+    return filtered.tobytes()
+
+
+def deflate_rows(band, row_len, level=6):
+    """
+    Filter and raw-deflate whole rows on their own, ending on a byte boundary,
+    for PNGStripWriter.write_deflated. Returns (data, adler32, filtered length).
+    """
+    filtered = filter_rows(band, row_len)
+    z = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return z.compress(filtered) + z.flush(zlib.Z_SYNC_FLUSH), zlib.adler32(filtered), len(filtered)
+
+
+def adler32_combine(adler1, adler2, len2):
+    """Adler-32 of A + B from adler32(A), adler32(B) and len(B), as zlib's adler32_combine."""
+    base = 65521
+    rem = len2 % base
+    sum1 = ((adler1 & 0xFFFF) + (adler2 & 0xFFFF) + base - 1) % base
+    sum2 = (rem * (adler1 & 0xFFFF) + (adler1 >> 16) + (adler2 >> 16) + base - rem) % base
+    return sum1 | (sum2 << 16)
+
+
+class PNGStripWriter:
+    """
+    Streams an 8-bit RGB PNG to a file object, one band of rows at a time.
+    Bands may also arrive already deflated (see deflate_rows), so they can be
+    compressed elsewhere, e.g. in worker processes.
+    """
+
+    def __init__(self, fileobj, width, height, level=6):
+        self._fp = fileobj
+        self._row_len = width * 3
+        # Raw deflate behind a hand-written zlib header, so deflated bands can be spliced in
+        self._z = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._adler = 1
+        self._zlib_header = b"\x78\x9c"
+        self._fp.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bits per sample, colour type 2 (RGB), deflate, adaptive filtering, no interlace
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, tag, data):
+        self._fp.write(struct.pack(">I", len(data)) + tag + data)
+        self._fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def _idat(self, data):
+        if data:
+            self._chunk(b"IDAT", self._zlib_header + data)
+            self._zlib_header = b""
+
+    def write(self, band):
+        """Append whole rows (a flat or 2-D uint8 array, width * 3 values per row)."""
+        filtered = filter_rows(band, self._row_len)
+        self._adler = zlib.adler32(filtered, self._adler)
+        self._idat(self._z.compress(filtered))
+
+    def write_deflated(self, data, adler, length):
+        """Append rows already compressed by deflate_rows."""
+        self._idat(self._z.flush(zlib.Z_SYNC_FLUSH))
+        self._adler = adler32_combine(self._adler, adler, length)
+        self._idat(data)
+
+    def close(self):
+        self._idat(self._z.flush() + struct.pack(">I", self._adler))
+        self._chunk(b"IEND", b"")